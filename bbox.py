@@ -3,6 +3,11 @@ import numpy as np
 from pathlib import Path
 from ultralytics import YOLO
 import json
+import os
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 """
 YOLO-based UI Panel Detection for Beyond All Reason
 ====================================================
@@ -22,6 +27,7 @@ SETUP INSTRUCTIONS:
 Usage Modes:
 - LABELING: Manually label UI panels in screenshots
 - TRAINING: Train YOLO model on labeled data
+- EXPORT: Convert the trained model to OpenVINO/TensorRT (FP16 or INT8)
 - INFERENCE: Detect UI panels automatically
 """
 
@@ -31,9 +37,78 @@ SCREENSHOT_DIR = "training_screenshots"
 LABELS_DIR = "yolo_labels"
 DATASET_DIR = "yolo_dataset"
 MODEL_PATH = "ui_detector.pt"  # Trained model path
+LABEL_STAGING_FILE = "_labels.staging"  # Label log, split into .txt files on flush
+# Train and run the detector on the bottom-right ROI crop at 320px instead of the
+# full frame at 640px. The shipped ui_detector.pt is a full-frame model, so leave
+# this off until it is retrained with it on (see README), and set the same
+# flag in processScreenshotsRapidOCR.py.
+ROI_DETECTOR = False
+ROI_START_X = 0.75  # The UI panel lives in the right 25% of the frame...
+ROI_START_Y = 0.25  # ...and the bottom 75%
+TRAIN_IMG_SIZE = 320 if ROI_DETECTOR else 640  # YOLO input size (train, export and inference)
+INFERENCE_BATCH_SIZE = 16  # Screenshots per YOLO forward pass in run_inference
+IO_WORKERS = 8  # Threads decoding/encoding PNGs around the model in run_inference
+PREFETCH_QUEUE_SIZE = 32  # Max decoded screenshots waiting for the model
+DATASET_WORKERS = 16  # Threads writing the train/val split in prepare_yolo_dataset
+EXPORT_FORMAT = "openvino"  # "openvino" (Intel CPU) or "engine" (TensorRT, NVIDIA GPU)
+EXPORTED_MODEL_PATH = "ui_detector_openvino_model"  # Use "ui_detector.engine" for TensorRT
+INT8_MODEL_PATH = "ui_detector_int8_openvino_model"  # Output of 'export int8' with OpenVINO
 
 # ===========================================================
 
+def find_pngs(directory):
+    """
+    Recursively yield Paths of all .png and .jpg screenshots under directory.
+    os.scandir reuses the directory entry type info, so no extra stat calls.
+    """
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from find_pngs(entry.path)
+            elif entry.name.endswith(('.png', '.jpg')):
+                yield Path(entry.path)
+
+
+def read_image(path):
+    """
+    Read and decode an image with one buffered read + cv2.imdecode.
+    Returns None if the file is missing or cannot be decoded, like cv2.imread.
+    """
+    try:
+        data = np.fromfile(str(path), dtype=np.uint8)
+    except OSError:
+        return None
+    if data.size == 0:
+        return None
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def crop_to_roi(img):
+    """
+    Crop a full screenshot to the bottom-right region the UI panel lives in.
+    Returns: (roi, crop_start_x, crop_start_y)
+    """
+    (H, W) = img.shape[:2]
+    crop_start_x = int(W * ROI_START_X)
+    crop_start_y = int(H * ROI_START_Y)
+    return img[crop_start_y:H, crop_start_x:W], crop_start_x, crop_start_y
+
+
+def detector_input(img):
+    """
+    The part of a full screenshot the detector sees: the ROI crop with
+    ROI_DETECTOR, else the whole frame.
+    Returns: (image, crop_start_x, crop_start_y)
+    """
+    if ROI_DETECTOR:
+        return crop_to_roi(img)
+    return img, 0, 0
+
+
 class YOLOUIDetector:
     """
     Complete YOLO-based UI detection system with labeling, training, and inference.
@@ -44,7 +119,16 @@ class YOLOUIDetector:
         self.labels_dir = Path(labels_dir)
         self.labels_dir.mkdir(exist_ok=True)
         
-        self.images = list(self.screenshot_dir.glob("**/*.png"))
+        # Labels are appended to one staging file and only split into
+        # per-image .txt files by flush_labels(), instead of an
+        # open/write/close per label.
+        self.staging_path = self.labels_dir / LABEL_STAGING_FILE
+        self.staged_labels = {}  # stem -> label line not yet flushed to .txt
+        self.label_writer = None
+        # Recover labels left behind by an interrupted session
+        self.flush_labels()
+        
+        self.images = list(find_pngs(self.screenshot_dir))
         if not self.images:
             print(f"ERROR: No PNG files found in {screenshot_dir}")
             return
@@ -93,7 +177,34 @@ class YOLOUIDetector:
         # Remove the rest of the original mouse logic (drawing=True, mousemove, LBUTTONDOWN)
         # as it is no longer needed for a single-click label.
     
-    # save_yolo_label remains unchanged
+    @staticmethod
+    def boxes_to_yolo(boxes_xyxy, img_width, img_height):
+        """
+        Convert an (N, 4) array of pixel (x1, y1, x2, y2) boxes to YOLO
+        (x_center, y_center, width, height) rows normalized to [0, 1].
+        """
+        boxes = np.asarray(boxes_xyxy, dtype=np.float64).reshape(-1, 4)
+        # Ensure correct order
+        top_left = np.minimum(boxes[:, 0:2], boxes[:, 2:4])
+        bottom_right = np.maximum(boxes[:, 0:2], boxes[:, 2:4])
+        size = np.array([img_width, img_height], dtype=np.float64)
+        centers = (top_left + bottom_right) / 2 / size
+        extents = (bottom_right - top_left) / size
+        return np.hstack([centers, extents])
+    
+    @staticmethod
+    def yolo_to_boxes(yolo_boxes, img_width, img_height):
+        """
+        Convert an (N, 4) array of normalized YOLO boxes back to
+        integer pixel (x1, y1, x2, y2) rows.
+        """
+        yolo = np.asarray(yolo_boxes, dtype=np.float64).reshape(-1, 4)
+        size = np.array([img_width, img_height], dtype=np.float64)
+        half = yolo[:, 2:4] / 2
+        top_left = (yolo[:, 0:2] - half) * size
+        bottom_right = (yolo[:, 0:2] + half) * size
+        return np.hstack([top_left, bottom_right]).astype(int)
+    
     def save_yolo_label(self, img_path, box, img_width, img_height):
         """
         Save bounding box in YOLO format:
@@ -107,47 +218,92 @@ class YOLOUIDetector:
         y1, y2 = min(y1, y2), max(y1, y2)
         
         # Convert to YOLO format (normalized center + size)
-        x_center = ((x1 + x2) / 2) / img_width
-        y_center = ((y1 + y2) / 2) / img_height
-        width = (x2 - x1) / img_width
-        height = (y2 - y1) / img_height
+        yolo = self.boxes_to_yolo([box], img_width, img_height)
+        x_center, y_center, width, height = yolo[0]
         
-        # Class 0 = UI panel
-        label_line = f"0 {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n"
+        # Stage label for a file with same name as image (class 0 = UI panel)
+        label_line = "0 %.6f %.6f %.6f %.6f\n" % tuple(yolo[0])
+        self.stage_label(img_path.stem, label_line)
         
-        # Save label file with same name as image
-        label_path = self.labels_dir / (img_path.stem + ".txt")
-        with open(label_path, 'w') as f:
-            f.write(label_line)
-        
-        print(f"  ✓ Saved label: {label_path.name}")
+        print(f"  ✓ Saved label: {img_path.stem}.txt")
         print(f"    Box: ({x1}, {y1}) to ({x2}, {y2})")
         print(f"    YOLO: class=0 x={x_center:.3f} y={y_center:.3f} w={width:.3f} h={height:.3f}")
 
-    # load_yolo_label remains unchanged
+    def stage_label(self, stem, label_line):
+        """
+        Append a label to the staging file. An empty label_line records
+        that any previous label for stem was removed.
+        """
+        if self.label_writer is None:
+            # Line buffered, so every label is on disk as soon as it's made
+            # and a crash loses none of them
+            self.label_writer = open(self.staging_path, 'a', buffering=1)
+        if label_line:
+            self.label_writer.write(f"{stem}\t{label_line}")
+            self.staged_labels[stem] = label_line
+        else:
+            self.label_writer.write(f"{stem}\t\n")
+            self.staged_labels.pop(stem, None)
+    
+    def flush_labels(self):
+        """
+        Split the staging file into per-image .txt label files.
+        Each file is written to a temp name then renamed into place, and the
+        last staged entry per image wins.
+        """
+        if self.label_writer is not None:
+            self.label_writer.close()
+            self.label_writer = None
+        
+        if not self.staging_path.exists():
+            return
+        
+        latest = {}
+        with open(self.staging_path, 'r') as f:
+            for line in f:
+                stem, _, label_line = line.partition('\t')
+                latest[stem] = label_line if label_line.strip() else None
+        
+        for stem, label_line in latest.items():
+            if label_line is None:
+                continue  # Label was removed after being staged
+            tmp_path = self.labels_dir / (stem + ".txt.tmp")
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, label_line.encode())
+            finally:
+                os.close(fd)
+            os.rename(tmp_path, self.labels_dir / (stem + ".txt"))
+        
+        self.staging_path.unlink()
+        self.staged_labels.clear()
+    
+    def count_labels(self):
+        """Number of images with a label, on disk or still staged."""
+        on_disk = {p.stem for p in self.labels_dir.glob("*.txt")}
+        return len(on_disk | self.staged_labels.keys())
+    
     def load_yolo_label(self, img_path, img_width, img_height):
         """Load existing YOLO label if it exists"""
         label_path = self.labels_dir / (img_path.stem + ".txt")
         
-        if not label_path.exists():
+        if img_path.stem in self.staged_labels:
+            line = self.staged_labels[img_path.stem].strip()
+        elif not label_path.exists():
             return None
-        
-        with open(label_path, 'r') as f:
-            line = f.readline().strip()
+        else:
+            with open(label_path, 'r') as f:
+                line = f.readline().strip()
         
         if not line:
             return None
         
         parts = line.split()
-        class_id, x_center, y_center, width, height = map(float, parts)
         
-        # Convert back to pixel coordinates
-        x1 = int((x_center - width/2) * img_width)
-        y1 = int((y_center - height/2) * img_height)
-        x2 = int((x_center + width/2) * img_width)
-        y2 = int((y_center + height/2) * img_height)
+        # Convert back to pixel coordinates (skip the class id)
+        x1, y1, x2, y2 = self.yolo_to_boxes([float(p) for p in parts[1:]], img_width, img_height)[0]
         
-        return (x1, y1, x2, y2)
+        return (int(x1), int(y1), int(x2), int(y2))
     
     def labeling_mode(self):
         """
@@ -171,95 +327,113 @@ class YOLOUIDetector:
         window_name = "YOLO Labeling Tool (1.5x Zoom)"
         cv2.namedWindow(window_name)
         
+        # The decoded/resized image is cached per index and the overlay is only
+        # redrawn when a key or click changed something, instead of every tick.
+        cached_idx = None
+        drawn_box = None
+        dirty = True
+        
         while True:
             img_path = self.images[self.current_idx]
-            img = cv2.imread(str(img_path))
-            
-            if img is None:
-                print(f"ERROR: Could not load {img_path}")
-                self.current_idx = (self.current_idx + 1) % len(self.images)
-                continue
-            
-            (H, W) = img.shape[:2]
-            
-            crop_start_x = int(W * 0.75)  # Start at 75% across (last 25%)
-            crop_start_y = int(H * 0.25)  # Start at 25% down (last 75%)
             
-            # Crop to bottom-right region
-            img_cropped = img[crop_start_y:H, crop_start_x:W]
-            (crop_H, crop_W) = img_cropped.shape[:2]
-            
-
-            zoom_scale = 1080/H
-            img_zoomed = cv2.resize(img_cropped, None, fx=zoom_scale, fy=zoom_scale, 
-                                     interpolation=cv2.INTER_CUBIC)
-            
-            # Load existing label if available
-            existing_box = self.load_yolo_label(img_path, W, H)
-            
-            # Adjust existing box to cropped/zoomed coordinates
-            if existing_box and self.current_box is None:
-                x1, y1, x2, y2 = existing_box
+            if cached_idx != self.current_idx:
+                img = read_image(img_path)
                 
-                # Convert to cropped coordinates
-                x1_crop = x1 - crop_start_x
-                y1_crop = y1 - crop_start_y
-                x2_crop = x2 - crop_start_x
-                y2_crop = y2 - crop_start_y
+                if img is None:
+                    print(f"ERROR: Could not load {img_path}")
+                    self.current_idx = (self.current_idx + 1) % len(self.images)
+                    continue
                 
-                # Scale to zoomed coordinates
-                x1_zoom = int(x1_crop * zoom_scale)
-                y1_zoom = int(y1_crop * zoom_scale)
-                x2_zoom = int(x2_crop * zoom_scale)
-                y2_zoom = int(y2_crop * zoom_scale)
+                (H, W) = img.shape[:2]
                 
-                self.current_box = (x1_zoom, y1_zoom, x2_zoom, y2_zoom)
-                print(f"\n✓ Loaded existing label for {img_path.name}")
-            
-            display_img = img_zoomed.copy()
-            
-            # Draw existing/current box
-            if self.current_box:
-                x1, y1, x2, y2 = self.current_box
-                cv2.rectangle(display_img, (x1, y1), (x2, y2), (0, 255, 0), 3)
+                # Crop to bottom-right region (75% across, 25% down)
+                img_cropped, crop_start_x, crop_start_y = crop_to_roi(img)
+                (crop_H, crop_W) = img_cropped.shape[:2]
                 
-                # Add info text
-                cv2.putText(display_img, "Press SPACE to save", (10, 40),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 2)
-            else:
-                cv2.putText(display_img, "Click TOP-LEFT of UI panel", (10, 40),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 255), 2)
-            
-            # Add skip info
-            cv2.putText(display_img, "Press 'S' to SKIP (no UI)", (10, 80),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 100, 100), 2)
-            
-            # Add image info
-            labeled_count = len(list(self.labels_dir.glob("*.txt")))
-            skipped_marker = self.labels_dir / (img_path.stem + ".skip")
-            is_skipped = skipped_marker.exists()
-            
-            status = "[UNLABELED]"
-            if is_skipped:
-                status = "[SKIPPED]"
-            elif existing_box or self.current_box: # Check if loaded or newly drawn
-                status = "[LABELED]"
+                zoom_scale = 1080/H
+                # Resize through UMat so OpenCV's T-API can run it on an OpenCL
+                # device (falls back to CPU transparently). Drawing stays on the
+                # host since the mouse callback needs the numpy shape.
+                # Bilinear is plenty for a labeling preview and much cheaper than cubic
+                img_zoomed = cv2.resize(cv2.UMat(img_cropped), None, fx=zoom_scale, fy=zoom_scale, 
+                                         interpolation=cv2.INTER_LINEAR).get()
+                debug_preview = cv2.resize(cv2.UMat(img), None, fx=0.25, fy=0.25, 
+                                           interpolation=cv2.INTER_AREA).get()
+                cached_idx = self.current_idx
+                dirty = True
             
-            info_text = f"Image {self.current_idx + 1}/{len(self.images)} | Labeled: {labeled_count} | {status}"
-            cv2.putText(display_img, info_text, (10, img_zoomed.shape[0] - 20),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
-            
-            cv2.putText(display_img, "1.5x ZOOM - Bottom-Right 25% x 45%", (10, img_zoomed.shape[0] - 60),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (200, 200, 200), 2)
-            
-            # Set mouse callback with all required parameters
-            cv2.setMouseCallback(window_name, self.mouse_callback, 
-                                 param=(display_img, 1.0, W, H, crop_start_x, crop_start_y))
-            cv2.imshow(window_name, display_img)
-            cv2.imshow("debug", cv2.resize(img, None, fx=0.25, fy=0.25, 
-                                    interpolation=cv2.INTER_CUBIC))
+            if dirty or self.current_box != drawn_box:
+                # Load existing label if available
+                existing_box = self.load_yolo_label(img_path, W, H)
+                
+                # Adjust existing box to cropped/zoomed coordinates
+                if existing_box and self.current_box is None:
+                    x1, y1, x2, y2 = existing_box
+                
+                    # Convert to cropped coordinates
+                    x1_crop = x1 - crop_start_x
+                    y1_crop = y1 - crop_start_y
+                    x2_crop = x2 - crop_start_x
+                    y2_crop = y2 - crop_start_y
+                
+                    # Scale to zoomed coordinates
+                    x1_zoom = int(x1_crop * zoom_scale)
+                    y1_zoom = int(y1_crop * zoom_scale)
+                    x2_zoom = int(x2_crop * zoom_scale)
+                    y2_zoom = int(y2_crop * zoom_scale)
+                
+                    self.current_box = (x1_zoom, y1_zoom, x2_zoom, y2_zoom)
+                    print(f"\n✓ Loaded existing label for {img_path.name}")
+                
+                display_img = img_zoomed.copy()
+                
+                # Draw existing/current box
+                if self.current_box:
+                    x1, y1, x2, y2 = self.current_box
+                    cv2.rectangle(display_img, (x1, y1), (x2, y2), (0, 255, 0), 3)
+                
+                    # Add info text
+                    cv2.putText(display_img, "Press SPACE to save", (10, 40),
+                               cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 2)
+                else:
+                    cv2.putText(display_img, "Click TOP-LEFT of UI panel", (10, 40),
+                               cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 255), 2)
+                
+                # Add skip info
+                cv2.putText(display_img, "Press 'S' to SKIP (no UI)", (10, 80),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 100, 100), 2)
+                
+                # Add image info
+                labeled_count = self.count_labels()
+                skipped_marker = self.labels_dir / (img_path.stem + ".skip")
+                is_skipped = skipped_marker.exists()
+                
+                status = "[UNLABELED]"
+                if is_skipped:
+                    status = "[SKIPPED]"
+                elif existing_box or self.current_box: # Check if loaded or newly drawn
+                    status = "[LABELED]"
+                
+                info_text = f"Image {self.current_idx + 1}/{len(self.images)} | Labeled: {labeled_count} | {status}"
+                cv2.putText(display_img, info_text, (10, img_zoomed.shape[0] - 20),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+                
+                cv2.putText(display_img, "1.5x ZOOM - Bottom-Right 25% x 45%", (10, img_zoomed.shape[0] - 60),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (200, 200, 200), 2)
+                
+                # Set mouse callback with all required parameters
+                cv2.setMouseCallback(window_name, self.mouse_callback, 
+                                     param=(display_img, 1.0, W, H, crop_start_x, crop_start_y))
+                cv2.imshow(window_name, display_img)
+                cv2.imshow("debug", debug_preview)
+                
+                drawn_box = self.current_box
+                dirty = False
             
-            key = cv2.waitKey(1) & 0xFF
+            # ~60 fps is enough for a labeling UI
+            key = cv2.waitKey(15) & 0xFF
+            if key != 255:
+                dirty = True
             
             if key == 27:  # ESC
                 break
@@ -304,7 +478,9 @@ class YOLOUIDetector:
                 skipped_marker = self.labels_dir / (img_path.stem + ".skip")
                 skipped_marker.touch()
                 
-                # Remove label if it exists
+                # Remove label if it exists (staged or on disk)
+                if img_path.stem in self.staged_labels:
+                    self.stage_label(img_path.stem, "")
                 label_path = self.labels_dir / (img_path.stem + ".txt")
                 if label_path.exists():
                     label_path.unlink()
@@ -332,6 +508,7 @@ class YOLOUIDetector:
                 print("  Box cleared")
         
         cv2.destroyAllWindows()
+        self.flush_labels()
         
         labeled_count = len(list(self.labels_dir.glob("*.txt")))
         skipped_count = len(list(self.labels_dir.glob("*.skip")))
@@ -341,6 +518,39 @@ class YOLOUIDetector:
         print(f"  - Labels saved to: {self.labels_dir}")
 
 
+def write_roi_sample(img_path, label_path, dataset_path, split):
+    """
+    Write one labeled screenshot as the detector sees it (see detector_input).
+    With ROI_DETECTOR, the crop is saved and its YOLO label is rewritten so
+    the coordinates are normalized to the crop instead of the full frame.
+    Without it, the image and label are copied unchanged.
+    """
+    if not ROI_DETECTOR:
+        shutil.copy2(img_path, dataset_path / "images" / split / img_path.name)
+        shutil.copy2(label_path, dataset_path / "labels" / split / label_path.name)
+        return
+    img = read_image(img_path)
+    if img is None:
+        print(f"ERROR: Could not load {img_path}")
+        return
+    (H, W) = img.shape[:2]
+    roi, crop_start_x, crop_start_y = detector_input(img)
+    (crop_H, crop_W) = roi.shape[:2]
+    
+    with open(label_path, 'r') as f:
+        class_id, x_center, y_center, width, height = map(float, f.readline().split())
+    
+    # Full-frame normalized -> crop-relative normalized
+    x_center = (x_center * W - crop_start_x) / crop_W
+    y_center = (y_center * H - crop_start_y) / crop_H
+    width = width * W / crop_W
+    height = height * H / crop_H
+    
+    cv2.imwrite(str(dataset_path / "images" / split / img_path.name), roi)
+    with open(dataset_path / "labels" / split / label_path.name, 'w') as f:
+        f.write(f"{int(class_id)} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
+
+
 def prepare_yolo_dataset(screenshot_dir, labels_dir, dataset_dir, train_split=0.8):
     """
     Prepare YOLO dataset structure:
@@ -366,9 +576,11 @@ def prepare_yolo_dataset(screenshot_dir, labels_dir, dataset_dir, train_split=0.
     images = []
     
     for label_file in labels:
-        img_path = Path(screenshot_dir) / f"{label_file.stem}.png"
-        if img_path.exists():
-            images.append((img_path, label_file))
+        for ext in ('.png', '.jpg'):
+            img_path = Path(screenshot_dir) / f"{label_file.stem}{ext}"
+            if img_path.exists():
+                images.append((img_path, label_file))
+                break
     
     print(f"\nFound {len(images)} labeled images")
     
@@ -386,16 +598,12 @@ def prepare_yolo_dataset(screenshot_dir, labels_dir, dataset_dir, train_split=0.
     print(f"Train set: {len(train_set)} images")
     print(f"Val set: {len(val_set)} images")
     
-    # Copy files
-    import shutil
-    
-    for img_path, label_path in train_set:
-        shutil.copy(img_path, dataset_path / "images" / "train" / img_path.name)
-        shutil.copy(label_path, dataset_path / "labels" / "train" / label_path.name)
-    
-    for img_path, label_path in val_set:
-        shutil.copy(img_path, dataset_path / "images" / "val" / img_path.name)
-        shutil.copy(label_path, dataset_path / "labels" / "val" / label_path.name)
+    # Write the detector's images and their labels in parallel; file copies
+    # and cv2 decoding/encoding release the GIL.
+    jobs = [(img_path, label_path, "train") for img_path, label_path in train_set]
+    jobs += [(img_path, label_path, "val") for img_path, label_path in val_set]
+    with ThreadPoolExecutor(max_workers=DATASET_WORKERS) as executor:
+        list(executor.map(lambda job: write_roi_sample(job[0], job[1], dataset_path, job[2]), jobs))
     
     # Create data.yaml
     yaml_content = f"""# Beyond All Reason UI Panel Detection Dataset
@@ -421,7 +629,7 @@ nc: 1
     return yaml_path
 
 
-def train_yolo_model(data_yaml, epochs=50, img_size=640):
+def train_yolo_model(data_yaml, epochs=50, img_size=TRAIN_IMG_SIZE):
     """
     Train a YOLO model on the prepared dataset.
     """
@@ -457,40 +665,93 @@ def train_yolo_model(data_yaml, epochs=50, img_size=640):
     return model
 
 
-def run_inference(model_path, screenshot_dir, output_dir="detected_ui"):
+def export_yolo_model(model_path, export_format=EXPORT_FORMAT, int8=False):
     """
-    Run inference on all screenshots and save results.
+    Export a trained .pt model to an optimized FP16 runtime.
+    "openvino" targets Intel CPUs, "engine" targets NVIDIA GPUs via TensorRT.
+    With int8=True, applies post-training INT8 quantization instead,
+    calibrated on the val split of the prepared dataset.
     """
-    import os
     print("\n" + "="*70)
-    print("RUNNING INFERENCE")
+    print("EXPORTING YOLO MODEL")
     print("="*70)
-    
+
     model = YOLO(model_path)
-    output_path = Path(output_dir)
-    output_path.mkdir(exist_ok=True)
+
+    # batch > 1 makes the OpenVINO backend compile in THROUGHPUT mode,
+    # which matches the batched predict() calls in run_inference. The batch
+    # dimension is dynamic (up to INFERENCE_BATCH_SIZE for TensorRT), as the
+    # last batch of a run is usually smaller.
+    if int8:
+        data_yaml = Path(DATASET_DIR) / "data.yaml"
+        if not data_yaml.exists():
+            print(f"ERROR: Calibration data not found at {data_yaml}")
+            print("Run 'train' mode first to prepare the dataset")
+            return None
+        precision = "INT8"
+        precision_args = {"int8": True, "data": str(data_yaml)}
+    else:
+        precision = "FP16"
+        precision_args = {"half": True}
+
+    exported_path = model.export(
+        format=export_format,
+        imgsz=TRAIN_IMG_SIZE,
+        batch=INFERENCE_BATCH_SIZE,
+        dynamic=True,
+        **precision_args
+    )
+
+    print(f"\n✓ Exported {model_path} ({export_format}, {precision}) to: {exported_path}")
+    return exported_path
+
+
+def prefetch_images(paths, max_workers=IO_WORKERS, max_pending=PREFETCH_QUEUE_SIZE):
+    """
+    Yield (path, image) pairs in order while a thread pool decodes
+    upcoming PNGs. At most max_pending decoded images are held in memory.
+    """
+    pending = queue.Queue(maxsize=max_pending)
     
-    screenshots = list(Path(screenshot_dir).glob("**/*.png"))
-    print(f"\nProcessing {len(screenshots)} screenshots...")
+    def producer(executor):
+        for path in paths:
+            pending.put((path, executor.submit(read_image, path)))
+        pending.put(None)
     
-    results_json = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        threading.Thread(target=producer, args=(executor,), daemon=True).start()
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            path, future = item
+            yield path, future.result()
+
+
+def infer_batch(model, batch, output_path, results_json, writer):
+    """
+    Run YOLO on one batch of (path, image) pairs, record detections in
+    results_json and hand visualizations to the writer pool.
+    Returns the list of pending write futures.
+    """
+    writes = []
+    # Feed the model the same input it was trained on
+    rois = [detector_input(img) for _, img in batch]
+    results = model.predict([roi for roi, _, _ in rois], imgsz=TRAIN_IMG_SIZE,
+                            verbose=False, stream=True)
     
-    for img_path in screenshots:
-        img = cv2.imread(str(img_path))
-        if img is None:
-            continue
-        
-        # Run inference
-        results = model(img, verbose=False)
-        
-        # Get bounding boxes
-        boxes = results[0].boxes
+    for (img_path, img), (_, crop_x, crop_y), result in zip(batch, rois, results):
+        boxes = result.boxes
         
         if len(boxes) > 0:
-            # Get the box with highest confidence
-            best_box = boxes[0]
-            x1, y1, x2, y2 = map(int, best_box.xyxy[0].tolist())
-            confidence = float(best_box.conf[0])
+            # Boxes are sorted by confidence, so the first is the best
+            xyxy = boxes.xyxy.cpu().numpy()
+            conf = boxes.conf.cpu().numpy()
+            x1, y1, x2, y2 = map(int, xyxy[0])
+            # Shift from crop coordinates back to the full frame
+            x1, x2 = x1 + crop_x, x2 + crop_x
+            y1, y2 = y1 + crop_y, y2 + crop_y
+            confidence = float(conf[0])
             
             print(f"✓ {img_path.name}: UI panel at ({x1}, {y1}, {x2}, {y2}) - conf: {confidence:.3f}")
             
@@ -500,18 +761,57 @@ def run_inference(model_path, screenshot_dir, output_dir="detected_ui"):
                 "confidence": confidence
             }
             
-            # Draw and save visualization
-            display = img.copy()
-            cv2.rectangle(display, (x1, y1), (x2, y2), (0, 255, 0), 3)
-            cv2.putText(display, f"UI Panel {confidence:.2f}", (x1, y1-10),
+            # Draw and save visualization directly on the decoded image;
+            # nothing reads it after this, so no copy is needed.
+            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 3)
+            cv2.putText(img, f"UI Panel {confidence:.2f}", (x1, y1-10),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
             
             out_path = output_path / img_path.name
-            cv2.imwrite(str(out_path), display)
+            writes.append(writer.submit(cv2.imwrite, str(out_path), img))
         else:
             print(f"✗ {img_path.name}: No UI panel detected")
             results_json[img_path.name] = None
     
+    return writes
+
+
+def run_inference(model_path, screenshot_dir, output_dir="detected_ui"):
+    """
+    Run inference on all screenshots and save results.
+    """
+    print("\n" + "="*70)
+    print("RUNNING INFERENCE")
+    print("="*70)
+    
+    model = YOLO(model_path)
+    output_path = Path(output_dir)
+    output_path.mkdir(exist_ok=True)
+    
+    screenshots = list(find_pngs(screenshot_dir))
+    print(f"\nProcessing {len(screenshots)} screenshots...")
+    
+    results_json = {}
+    
+    # Three overlapping stages: reader threads decode PNGs ahead of the
+    # model, the model consumes full batches, and writer threads encode
+    # the visualizations, so disk I/O hides behind GPU compute.
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as writer:
+        pending_writes = []
+        batch = []
+        for img_path, img in prefetch_images(screenshots):
+            if img is None:
+                continue
+            batch.append((img_path, img))
+            if len(batch) == INFERENCE_BATCH_SIZE:
+                pending_writes += infer_batch(model, batch, output_path, results_json, writer)
+                batch = []
+        if batch:
+            pending_writes += infer_batch(model, batch, output_path, results_json, writer)
+        
+        for future in pending_writes:
+            future.result()
+    
     # Save JSON results
     json_path = output_path / "detections.json"
     with open(json_path, 'w') as f:
@@ -532,6 +832,8 @@ def main():
         print("\nUsage:")
         print("  python yolo_ui_detector.py label      - Label training data")
         print("  python yolo_ui_detector.py train      - Train YOLO model")
+        print("  python yolo_ui_detector.py export     - Export model to OpenVINO/TensorRT (FP16)")
+        print("  python yolo_ui_detector.py export int8 - Export INT8-quantized model (calibrated on val set)")
         print("  python yolo_ui_detector.py infer      - Run inference on screenshots")
         print("  python yolo_ui_detector.py pipeline   - Complete pipeline (label + train + infer)")
         return
@@ -547,8 +849,22 @@ def main():
         if yaml_path:
             train_yolo_model(yaml_path, epochs=100)
         
-    elif mode == "infer":
+    elif mode == "export":
         if not Path(MODEL_PATH).exists():
+            print(f"ERROR: Model not found at {MODEL_PATH}")
+            print("Run 'train' mode first to create a model")
+            return
+        int8 = len(sys.argv) > 2 and sys.argv[2].lower() == "int8"
+        export_yolo_model(MODEL_PATH, int8=int8)
+
+    elif mode == "infer":
+        if Path(INT8_MODEL_PATH).exists():
+            # Prefer the quantized INT8 model, then the FP16 export
+            MODEL_PATH_ACTUAL = INT8_MODEL_PATH
+        elif Path(EXPORTED_MODEL_PATH).exists():
+            # Prefer the exported FP16 OpenVINO/TensorRT model
+            MODEL_PATH_ACTUAL = EXPORTED_MODEL_PATH
+        elif not Path(MODEL_PATH).exists():
             # Try to find trained model
             trained_model = Path("runs/detect/ui_panel_detector/weights/best.pt")
             if trained_model.exists():
@@ -588,7 +904,7 @@ def main():
     
     else:
         print(f"ERROR: Unknown mode '{mode}'")
-        print("Valid modes: label, train, infer, pipeline")
+        print("Valid modes: label, train, export, infer, pipeline")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,20 @@
 import sqlite3
-import json
 from datetime import datetime
-from collections import defaultdict
 import concurrent.futures
+from functools import lru_cache
+from itertools import islice
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
 import os
+import sys
 import time
 
+import numpy as np
+
+# Much faster JSON parser/serializer for the screenshot and matches files
+# pip install orjson
+import orjson
+
 # Use the much faster rapidfuzz library (drop-in replacement for thefuzz)
 # pip install rapidfuzz
 from rapidfuzz import fuzz, process
@@ -27,72 +36,150 @@ MINIMUM_MATCH_THRESHOLD = 50
 # Using ProcessPoolExecutor, so this is now # of processes, not threads.
 MAX_WORKERS = os.cpu_count() or 20
 
+# Videos sent to a worker per IPC round-trip
+MAP_CHUNKSIZE = 16
+
+# Chunks submitted to the pool but not yet collected, per worker. Chunks are
+# only made (and their videos pickled) as earlier ones finish.
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
 # How far back from the video upload date to search for battles
 MAX_DATE_RANGE_MONTHS = 8
 
 # Mininum number of OCR recognitions to perform a compare.
 MIN_LEN = 6
 
+# A candidate battle must share at least this many exact player names with
+# the screenshot (or one in MIN_CANDIDATE_OVERLAP_DIVISOR of the OCR names,
+# whichever is larger) before it is fuzzy scored. This is an approximation
+# to skip most of the fuzzy scoring: a battle with fewer exact names can
+# still have the best fuzzy score (e.g. when OCR misread most names), so
+# raising these can change the matches, and lowering them finds more at the
+# cost of speed.
+MIN_CANDIDATE_OVERLAP = 2
+MIN_CANDIDATE_OVERLAP_DIVISOR = 3
+
+# A battle containing every OCR name, with a roster at most this many times
+# the OCR name count, is taken as a match (score 100) without fuzzy scoring,
+# as long as it is the only such battle.
+PERFECT_ROSTER_RATIO = 1.2
+
+# Rows pulled from SQLite per fetch while loading the index
+FETCH_BATCH_SIZE = 10000
+
+# Rows per executemany call when saving matches
+INSERT_BATCH_SIZE = 10000
+
 # --- END CONFIGURATION ---
 
 
+# Marks a battle whose timestamp could not be parsed (date filter is skipped for it)
+UNKNOWN_TIMESTAMP = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1)
+
 # --- Globals for Worker Processes ---
 # These will be populated by the init_worker function
 # to avoid passing large data with every task.
-g_inverted_index = None
-g_battle_data = None
+g_shm = None
+g_index = None
 
 
-def init_worker(inverted_index, battle_data):
+def init_worker(shm_name, layout):
     """
     Initializer for each worker process.
-    This runs ONCE per process, loading the large read-only
-    data into the process's global scope.
+    This runs ONCE per process and attaches to the packed read-only
+    index in shared memory, so nothing large is pickled or copied.
     """
-    global g_inverted_index, g_battle_data
-    g_inverted_index = inverted_index
-    g_battle_data = battle_data
-    print(f"Worker process {os.getpid()} initialized with data.")
+    global g_shm, g_index
+    g_shm, g_index = attach_shared_index(shm_name, layout)
+    print(f"Worker process {os.getpid()} attached to shared index.")
+
+
+def group_bounds(keys):
+    """Start/end indices of each run of equal values in a sorted numpy array."""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    return np.concatenate(([0], starts)), np.concatenate((starts, [len(keys)]))
+
+
+def warm_up(_):
+    """No-op task used to start every worker before the timed run."""
+    return os.getpid()
+
+
+def get_pool_context():
+    """
+    Uses a forkserver where the platform has one: workers start from a small
+    server process with the heavy modules preloaded, instead of copying this
+    process. Falls back to the default start method (e.g. spawn on Windows).
+    """
+    if 'forkserver' not in mp.get_all_start_methods():
+        return mp.get_context()
+    ctx = mp.get_context('forkserver')
+    ctx.set_forkserver_preload(['numpy', 'rapidfuzz', 'rapidfuzz.fuzz', 'rapidfuzz.process'])
+    return ctx
 
 
 def load_data_from_db(conn):
     """
-    Loads data by fetching battles first, then iterating through
-    all participants once to build both data structures.
+    Loads data by fetching battles first, then reading all participants
+    once in player_name order and grouping them with numpy.
     """
     print("Loading data from database...")
     cursor = conn.cursor()
+    cursor.arraysize = FETCH_BATCH_SIZE
 
-    inverted_index = defaultdict(list)
     battle_data = {}
 
     # 1. Load all battle metadata first. This is fast.
     print("  Loading battle metadata...")
     cursor.execute("SELECT battle_id, timestamp FROM battles")
-    for battle_id, timestamp in cursor.fetchall():
+    for battle_id, timestamp in cursor:
         battle_data[battle_id] = {
             'timestamp': timestamp,
             'players': set()  # Initialize with an empty set
         }
 
-    # 2. Load all participants ONCE and build both structures
+    # 2. Load all participants ONCE, already sorted by player, and build both structures
     print("  Building player inverted index and populating battle data...")
-    cursor.execute("SELECT battle_id, player_name FROM battle_participants")
+    cursor.execute("""
+        SELECT battle_id, player_name FROM battle_participants
+        WHERE player_name IS NOT NULL AND player_name != ''
+        ORDER BY player_name
+    """)
+    # Stream the rows in batches rather than materializing every tuple at once.
+    # Names are interned so every row of a player shares one string object:
+    # less memory, and the sort/group compares short-circuit on identity.
+    battle_id_list = []
+    player_name_list = []
+    while rows := cursor.fetchmany():
+        battle_id_list.extend(r[0] for r in rows)
+        player_name_list.extend(sys.intern(r[1]) for r in rows)
+    battle_ids = np.array(battle_id_list, dtype=object)
+    player_names = np.array(player_name_list, dtype=object)
+    del battle_id_list, player_name_list
+    
+    # A. Build the inverted index: each player's battles are a slice of the sorted rows
+    starts, ends = group_bounds(player_names)
+    inverted_index = {
+        player_names[start]: battle_ids[start:end]
+        for start, end in zip(starts.tolist(), ends.tolist())
+    }
+    
+    # B. Populate the battle_data dictionary, grouping the same rows by battle
+    order = np.argsort(battle_ids, kind='stable')
+    by_battle = battle_ids[order]
+    names_by_battle = player_names[order]
     
     missing_battles = 0
-    for battle_id, player_name in cursor.fetchall():
-        if not player_name:
-            continue
-        
-        # A. Build the inverted index
-        inverted_index[player_name].append(battle_id)
-        
-        # B. Populate the battle_data dictionary
-        if battle_id in battle_data:
-            battle_data[battle_id]['players'].add(player_name)
+    for start, end in zip(*(b.tolist() for b in group_bounds(by_battle))):
+        battle_info = battle_data.get(by_battle[start])
+        if battle_info is not None:
+            battle_info['players'] = frozenset(names_by_battle[start:end])
         else:
             # This can happen if a participant is linked to a non-existent battle
-            missing_battles += 1
+            missing_battles += end - start
 
     if missing_battles > 0:
         print(f"  Warning: Found {missing_battles} participant entries for battles not in the 'battles' table.")
@@ -101,117 +188,265 @@ def load_data_from_db(conn):
     return inverted_index, battle_data
 
 
-def find_best_match(ocr_player_list, video_upload_date_str, inverted_index, battle_data):
+def parse_battle_timestamp(timestamp):
+    """Converts a battle timestamp to naive unix seconds, or UNKNOWN_TIMESTAMP if it can't be parsed."""
+    try:
+        # Remove timezone info to compare with the naive upload date.
+        # This assumes battle timestamps are UTC, but compares them all consistently.
+        battle_dt = datetime.fromisoformat(timestamp.split('.')[0].replace('Z', ''))
+        return int((battle_dt.replace(tzinfo=None) - EPOCH).total_seconds())
+    except Exception:
+        return UNKNOWN_TIMESTAMP
+
+
+def canonical_tokens(text):
+    """Whitespace tokens sorted and re-joined, the form token_sort_ratio compares."""
+    return " ".join(sorted(text.split()))
+
+
+def pack_index(inverted_index, battle_data):
+    """
+    Flattens the dict-based index into numpy arrays that can live in shared memory.
+    Battles are referenced by their row number in 'battle_ids'.
+      names / name_offsets / battle_rows_flat:
+        sorted player names; battle_rows_flat[name_offsets[i]:name_offsets[i+1]]
+        are the battles of names[i].
+      battle_ids / timestamps / player_offsets / players_flat:
+        per battle row; players_flat[player_offsets[r]:player_offsets[r+1]]
+        are indices into 'names'.
+      canon_buf / canon_offsets:
+        per battle row, the roster as one utf-8 string of sorted tokens,
+        ready for the fuzzy scorers.
+    """
+    battle_id_list = list(battle_data)
+    battle_row = {battle_id: row for row, battle_id in enumerate(battle_id_list)}
+
+    # Participants of battles missing from the 'battles' table can never match, so drop them
+    name_list = sorted(
+        name for name, battle_ids in inverted_index.items()
+        if any(battle_id in battle_row for battle_id in battle_ids)
+    )
+    name_row = {name: row for row, name in enumerate(name_list)}
+
+    name_offsets = [0]
+    battle_rows_flat = []
+    for name in name_list:
+        battle_rows_flat.extend(battle_row[b] for b in inverted_index[name] if b in battle_row)
+        name_offsets.append(len(battle_rows_flat))
+
+    player_offsets = [0]
+    players_flat = []
+    timestamps = []
+    canon_list = []
+    for battle_id in battle_id_list:
+        info = battle_data[battle_id]
+        players_flat.extend(name_row[name] for name in info['players'])
+        player_offsets.append(len(players_flat))
+        timestamps.append(parse_battle_timestamp(info['timestamp']))
+        canon_list.append(canonical_tokens(" ".join(info['players'])).encode('utf-8'))
+    canon_offsets = np.zeros(len(canon_list) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in canon_list], out=canon_offsets[1:])
+
+    # Sorting the str list and the utf-8 bytes agree, so the fixed-width
+    # byte array stays sorted for np.searchsorted
+    return {
+        'names': np.array([n.encode('utf-8') for n in name_list], dtype='S'),
+        'name_offsets': np.array(name_offsets, dtype=np.int64),
+        'battle_rows_flat': np.array(battle_rows_flat, dtype=np.int64),
+        'battle_ids': np.array([str(b).encode('utf-8') for b in battle_id_list], dtype='S'),
+        'timestamps': np.array(timestamps, dtype=np.int64),
+        'player_offsets': np.array(player_offsets, dtype=np.int64),
+        'players_flat': np.array(players_flat, dtype=np.int64),
+        'canon_buf': np.frombuffer(b"".join(canon_list), dtype=np.uint8),
+        'canon_offsets': canon_offsets,
+    }
+
+
+def create_shared_index(arrays):
+    """
+    Copies the packed arrays into one SharedMemory block.
+    Returns the block and a small picklable layout of (key, dtype, shape, offset).
+    """
+    layout = []
+    size = 0
+    for key, arr in arrays.items():
+        size = (size + 7) & ~7  # keep every array 8-byte aligned
+        layout.append((key, arr.dtype.str, arr.shape, size))
+        size += arr.nbytes
+
+    shm = SharedMemory(create=True, size=max(size, 1))
+    for key, dtype, shape, offset in layout:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = arrays[key]
+    return shm, layout
+
+
+def index_views(shm, layout):
+    """Zero-copy array views into a shared block. Drop them before shm.close()."""
+    return {
+        key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        for key, dtype, shape, offset in layout
+    }
+
+
+def attach_shared_index(shm_name, layout):
+    """Attaches to the shared block and returns zero-copy array views into it."""
+    shm = SharedMemory(name=shm_name)
+    # Keep 'shm' referenced for as long as the views are used
+    return shm, index_views(shm, layout)
+
+
+def lookup_battles(index, ocr_names):
     """
-    Finds the best battle_id for a given list of OCR'd players.
-    Applies 6-month date filter. Uses raw, case-sensitive strings.
-    (This function is unchanged, as it's just pure logic)
+    Binary searches all player names in one np.searchsorted call.
+    Returns the battle rows of every name that was found, concatenated
+    (a row appears once per matching name).
+    """
+    names = index['names']
+    flat = index['battle_rows_flat']
+    # Longer keys can't be in the array (and would be truncated by the cast)
+    keys = [k for k in (n.encode('utf-8') for n in ocr_names) if len(k) <= names.dtype.itemsize]
+    if not keys or len(names) == 0:
+        return flat[:0]
+    keys = np.array(keys, dtype=names.dtype)
+    
+    idx = np.searchsorted(names, keys)
+    found = idx < len(names)
+    found[found] = names[idx[found]] == keys[found]
+    idx = idx[found]
+    
+    offsets = index['name_offsets']
+    return np.concatenate([flat[offsets[i]:offsets[i + 1]] for i in idx.tolist()] or [flat[:0]])
+
+
+def battle_canon(index, row):
+    """Returns the precomputed sorted-token roster string of a battle row."""
+    offsets = index['canon_offsets']
+    return index['canon_buf'][offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+
+@lru_cache(maxsize=None)
+def upload_date_window(video_upload_date_str):
+    """
+    Converts a video's 'YYYYMMDD' upload date into the [start, end) range of
+    battle unix seconds allowed by the date filter, or None if it can't be parsed.
+    Computed once per video, then shared by all of its screenshots. Cached,
+    since many videos share an upload date.
+    """
+    try:
+        # Parse the 'YYYYMMDD' date. This creates a naive datetime.
+        upload_dt = datetime.strptime(video_upload_date_str, '%Y%m%d')
+        # Calculate the earliest allowed battle date
+        earliest_allowed_dt = upload_dt - relativedelta(months=MAX_DATE_RANGE_MONTHS)
+    except (ValueError, TypeError):
+        # print(f"Warning: Skipping date filter due to invalid upload_date: {video_upload_date_str}")
+        return None
+    
+    # Whole days: from the start of the earliest day up to the end of the upload day
+    start_sec = (earliest_allowed_dt - EPOCH).days * 86400
+    end_sec = ((upload_dt - EPOCH).days + 1) * 86400
+    return start_sec, end_sec
+
+
+def find_best_match(ocr_player_list, ocr_name_set, date_window, index):
+    """
+    Finds the best battle row for a given list of OCR'd players.
+    ocr_name_set is the deduplicated non-empty names of ocr_player_list.
+    Applies 6-month date filter (see upload_date_window). Uses raw, case-sensitive strings.
     """
     
     # Use raw OCR'd names
-    ocr_name_set = set(p for p in ocr_player_list if p)
     if not ocr_name_set:
         return None, 0 # No valid players in screenshot
     
     if len(ocr_name_set) < MIN_LEN:
         return None, 0
     
+    # Skip AI games
+    if any("(AI)" in ocr_name or "(Al)" in ocr_name for ocr_name in ocr_name_set):
+        return None, 0
+    
     # 2. FILTER: Find candidate battles
-    candidate_scores = defaultdict(int)
-    
-    # Use the inverted index to find potential matches
-    for ocr_name in ocr_name_set:
-        # Find battles this player was in (case-sensitive)
-        matched_battles = inverted_index.get(ocr_name, [])
-        for battle_id in matched_battles:
-            # Add 1 to this battle's "candidate score"
-            candidate_scores[battle_id] += 1
-        # Skip AI games
-        if "(AI)" in ocr_name or "(Al)" in ocr_name:
-            return None, 0 
-
-    if not candidate_scores:
+    # Use the inverted index to find the battles each player was in (case-sensitive)
+    matched_battles = lookup_battles(index, ocr_name_set)
+    
+    # candidate_scores[i] is how many OCR names appear in candidate_rows[i]
+    candidate_rows, candidate_scores = np.unique(matched_battles, return_counts=True)
+
+    if len(candidate_rows) == 0:
         # No player was recognized in the index
         return None, 0
+    
+    # Only fuzzy score battles sharing enough exact names; an approximation
+    # (see MIN_CANDIDATE_OVERLAP) that can drop the best fuzzy match
+    min_overlap = max(MIN_CANDIDATE_OVERLAP, len(ocr_name_set) // MIN_CANDIDATE_OVERLAP_DIVISOR)
+    keep = candidate_scores >= min_overlap
+    candidate_rows = candidate_rows[keep]
+    candidate_scores = candidate_scores[keep]
+    
+    if len(candidate_rows) == 0:
+        return None, 0
 
     # 3. FILTER: Apply date filter
     # A battle *must* have occurred before the video was uploaded
     # and *not* be older than MAX_DATE_RANGE_MONTHS.
-    try:
-        # Parse the 'YYYYMMDD' date. This creates a naive datetime.
-        upload_dt = datetime.strptime(video_upload_date_str, '%Y%m%d')
-        # Calculate the earliest allowed battle date
-        earliest_allowed_dt = upload_dt - relativedelta(months=MAX_DATE_RANGE_MONTHS)
-    except (ValueError, TypeError):
-        # print(f"Warning: Skipping date filter due to invalid upload_date: {video_upload_date_str}")
-        upload_dt = None
-        earliest_allowed_dt = None
+    valid_candidates = candidate_rows
+    valid_scores = candidate_scores
+    if date_window:
+        start_sec, end_sec = date_window
+        battle_ts = index['timestamps'][candidate_rows]
         
-    valid_candidates = []
-    for battle_id in candidate_scores:
-        battle_info = battle_data.get(battle_id)
-        if not battle_info:
-            continue # Should not happen if DB is consistent
-
-        # Date Check
-        if upload_dt:
-            try:
-                # Parse battle timestamp, removing timezone info to compare with naive upload_dt
-                # This assumes battle timestamps are UTC, but compares them all consistently.
-                battle_dt = datetime.fromisoformat(battle_info['timestamp'].split('.')[0].replace('Z', ''))
-                
-                # Check 1: Battle must be ON OR BEFORE the video upload
-                # (Allowing same-day)
-                if battle_dt.date() > upload_dt.date():
-                    continue
-                    
-                # Check 2: Battle must NOT be older than the allowed range
-                if battle_dt.date() < earliest_allowed_dt.date():
-                    continue
-            except Exception as e:
-                # print(f"Warning: Could not parse battle timestamp {battle_info['timestamp']}. Error: {e}")
-                pass # Skip this battle if timestamp is bad
-                
-        valid_candidates.append(battle_id)
+        # Check 1: Battle must be ON OR BEFORE the video upload (Allowing same-day)
+        # Check 2: Battle must NOT be older than the allowed range
+        # Battles with an unparseable timestamp skip the date check.
+        in_range = (battle_ts >= start_sec) & (battle_ts < end_sec)
+        in_window = in_range | (battle_ts == UNKNOWN_TIMESTAMP)
+        valid_candidates = candidate_rows[in_window]
+        valid_scores = candidate_scores[in_window]
         
-    if not valid_candidates:
+    if len(valid_candidates) == 0:
         return None, 0
+    
+    # Exact-match short-circuit: if exactly one battle contains every OCR name
+    # and its roster is barely larger than the screenshot, it's unambiguous.
+    player_offsets = index['player_offsets']
+    roster_sizes = player_offsets[valid_candidates + 1] - player_offsets[valid_candidates]
+    perfect = (valid_scores == len(ocr_name_set)) & (roster_sizes <= len(ocr_name_set) * PERFECT_ROSTER_RATIO)
+    if np.count_nonzero(perfect) == 1:
+        return int(valid_candidates[perfect][0]), 100
         
     # 4. SCORE: Find the best match among the valid candidates
-    # Convert set to list for stability
-    best_score = -1
-    best_battle_id = None
-    
     # Pre-convert OCR list to a single string for token algorithms
     # This is faster and more robust for token_sort_ratio
     ocr_str = " ".join(ocr_player_list)
+    ocr_canon = canonical_tokens(ocr_str)
     
-    for battle_id in valid_candidates:
-        clean_player_set = battle_data[battle_id]['players']
-        clean_player_list = list(clean_player_set)
-        
-        # Join the battle roster into a string
-        battle_str = " ".join(clean_player_list)
-        
-        # 1. Set Ratio: Checks if OCR is a valid SUBSET of Battle
-        # Returns 100 for (a,b) vs (a,b,c,d)
-        score_set = fuzz.token_set_ratio(ocr_str, battle_str)
-        
-        # 2. Sort Ratio: Checks if the TOTAL CONTENT matches
-        # Returns ~50 for (a,b) vs (a,b,c,d) because of length difference
-        score_sort = fuzz.token_sort_ratio(ocr_str, battle_str)
-        
-        # 3. Hybrid Score: Average them
-        # (a,b) -> (100 + 50) / 2 = 75
-        # (a,b,c,d) -> (100 + 100) / 2 = 100
-        score = (score_set + score_sort) / 2
-        
-        if score > best_score:
-            best_score = score
-            best_battle_id = battle_id
+    # Each battle roster was joined and token-sorted once when the index was packed
+    battle_strs = [battle_canon(index, row) for row in valid_candidates]
+    
+    # Score all candidates with one batched cdist call per scorer
+    # instead of one Python -> C call per candidate battle.
+    # 1. Set Ratio: Checks if OCR is a valid SUBSET of Battle
+    # Returns 100 for (a,b) vs (a,b,c,d)
+    scores_set = process.cdist([ocr_str], battle_strs, scorer=fuzz.token_set_ratio, dtype=np.float64)[0]
+    
+    # 2. Sort Ratio: Checks if the TOTAL CONTENT matches
+    # Returns ~50 for (a,b) vs (a,b,c,d) because of length difference
+    # Both sides are already token-sorted, so plain ratio equals token_sort_ratio
+    scores_sort = process.cdist([ocr_canon], battle_strs, scorer=fuzz.ratio, dtype=np.float64)[0]
+    
+    # 3. Hybrid Score: Average them
+    # (a,b) -> (100 + 50) / 2 = 75
+    # (a,b,c,d) -> (100 + 100) / 2 = 100
+    scores = (scores_set + scores_sort) / 2
+    
+    # On ties argmax keeps the first candidate, i.e. the lowest battle row
+    # (np.unique sorted them), not necessarily the one the old loop picked
+    best_idx = int(scores.argmax())
+    best_score = float(scores[best_idx])
+    best_battle_row = int(valid_candidates[best_idx])
 
     if best_score >= MINIMUM_MATCH_THRESHOLD:
-        return best_battle_id, best_score
+        return best_battle_row, best_score
     else:
         return None, best_score
 
@@ -224,9 +459,8 @@ def process_video_task(task_args):
     
     task_args is now just (video_id, video_info)
     """
-    # ***MODIFIED***
-    # Access the large data from the worker's global scope
-    global g_inverted_index, g_battle_data
+    # Access the shared index from the worker's global scope
+    global g_index
     
     # Unpack the lightweight task-specific data
     video_id, video_info = task_args
@@ -240,46 +474,77 @@ def process_video_task(task_args):
         video_info.get('uploader')
     )
     
-    matches_db_list = []
-    screenshots_json_dict = {}
+    date_window = upload_date_window(video_info.get('upload_date'))
     
+    # Results go back as parallel arrays, one entry per screenshot in dict order.
+    # The main process already has the OCR lists, so they aren't sent back.
     screenshots = video_info.get('screenshots', {})
-    for timestamp_sec, ocr_player_list in screenshots.items():
+    timestamps = np.empty(len(screenshots), dtype=np.int64)
+    battle_rows = np.full(len(screenshots), -1, dtype=np.int64)  # -1 = no match
+    scores = np.zeros(len(screenshots), dtype=np.float64)
+    
+    for i, (timestamp_sec, ocr_player_list) in enumerate(screenshots.items()):
+        # Dedupe the raw OCR'd names once, as an immutable set
+        ocr_name_set = frozenset(filter(None, ocr_player_list))
         
-        # ***MODIFIED***
-        # Pass the process-global data to the matching function
-        battle_id, score = find_best_match(
+        # Pass the process-global index to the matching function
+        battle_row, score = find_best_match(
             ocr_player_list,
-            video_info.get('upload_date'),
-            g_inverted_index,
-            g_battle_data
+            ocr_name_set,
+            date_window,
+            g_index
         )
         
-        if battle_id:
+        timestamps[i] = int(timestamp_sec)
+        scores[i] = score
+        if battle_row is not None:
+            battle_rows[i] = battle_row
+            
+    return (video_id, video_db_tuple, timestamps, battle_rows, scores)
+
+
+def process_video_chunk(chunk):
+    """Runs process_video_task on a list of tasks sent as one message."""
+    return [process_video_task(task_args) for task_args in chunk]
+
+
+def collect_video_results(index, video_id, screenshots, timestamps, battle_rows, scores):
+    """
+    Turns one video's result arrays back into DB rows and the output JSON
+    screenshots dict. Runs in the main process.
+    """
+    battle_ids = [b.decode('utf-8') for b in index['battle_ids'][battle_rows[battle_rows >= 0]]]
+    player_offsets = index['player_offsets']
+    matched = iter(battle_ids)
+    
+    matches_db_list = []
+    screenshots_json_dict = {}
+    for (timestamp_sec, ocr_player_list), ts, battle_row, score in zip(
+            screenshots.items(), timestamps.tolist(), battle_rows.tolist(), scores.tolist()):
+        
+        if battle_row >= 0:
+            battle_id = next(matched)
+            
             # Add to our batch for DB insertion
             matches_db_list.append((
                 battle_id,
                 video_id,
-                int(timestamp_sec),
+                ts,
                 score,
                 len(ocr_player_list),
-                len(g_battle_data[battle_id]['players']) # Use global data
+                int(player_offsets[battle_row + 1] - player_offsets[battle_row])
             ))
-            
-            # Update the output JSON structure
-            screenshots_json_dict[timestamp_sec] = {
-                "players_ocr": ocr_player_list,
-                "matched_battle_id": battle_id,
-                "match_score": round(score, 2)
-            }
         else:
-            screenshots_json_dict[timestamp_sec] = {
-                "players_ocr": ocr_player_list,
-                "matched_battle_id": None,
-                "match_score": round(score, 2)
-            }
+            battle_id = None
             
-    return (video_id, video_db_tuple, matches_db_list, screenshots_json_dict)
+        # Update the output JSON structure
+        screenshots_json_dict[timestamp_sec] = {
+            "players_ocr": ocr_player_list,
+            "matched_battle_id": battle_id,
+            "match_score": round(score, 2)
+        }
+        
+    return matches_db_list, screenshots_json_dict
 
 
 def main():
@@ -288,20 +553,32 @@ def main():
     # 1. Connect to DB and load all data into memory
     # This is done ONCE in the main thread.
     conn = sqlite3.connect(DB_NAME)
-    # ***MODIFIED***
-    # Load data into local variables that will be passed to the initializer
     inverted_index, battle_data = load_data_from_db(conn)
     conn.close() 
     
+    # Pack the index into flat arrays in shared memory. Workers attach to it
+    # by name instead of each receiving a pickled copy of the dicts.
+    shm, layout = create_shared_index(pack_index(inverted_index, battle_data))
+    del inverted_index, battle_data
+    # The main process decodes the battle rows workers send back
+    index = index_views(shm, layout)
+    print(f"Packed index into {shm.size / 1e6:.1f} MB of shared memory.")
+    
     # 2. Load the screenshot JSON
     try:
-        with open(SCREENSHOT_JSON_FILE, 'r') as f:
-            videos_data = json.load(f)
+        with open(SCREENSHOT_JSON_FILE, 'rb') as f:
+            videos_data = orjson.loads(f.read())
     except FileNotFoundError:
         print(f"Error: Could not find '{SCREENSHOT_JSON_FILE}'.")
+        index = None
+        shm.close()
+        shm.unlink()
         return
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print(f"Error: Could not parse '{SCREENSHOT_JSON_FILE}'. Check for JSON errors.")
+        index = None
+        shm.close()
+        shm.unlink()
         return
 
     print(f"Loaded {len(videos_data)} videos from '{SCREENSHOT_JSON_FILE}'.")
@@ -315,41 +592,62 @@ def main():
     
     # 3. Process each video and screenshot using a ProcessPool
     print(f"\n--- Starting parallel processing with {MAX_WORKERS} processes ---")
-    start_time = time.perf_counter()
-    
-    # ***MODIFIED***
-    # Create a list of tasks. Each task is a tuple of arguments
-    # for our process_video_task function.
-    # We now ONLY pass the small, video-specific data.
-    tasks = [
-        (vid, vinfo) 
-        for vid, vinfo in videos_data.items()
-    ]
-    
-    # ***MODIFIED***
+    
+    # Each task is a (video_id, video_info) tuple for process_video_task.
+    # We now ONLY pass the small, video-specific data, streamed from the dict
+    # instead of copied into a list first.
+    tasks = iter(videos_data.items())
+    
     # Switch to ProcessPoolExecutor
-    with concurrent.futures.ProcessPoolExecutor(
-        max_workers=MAX_WORKERS,
-        initializer=init_worker,
-        initargs=(inverted_index, battle_data) # Pass large data to initializer
-        
-    ) as executor:
-        
-        # Use executor.map to process tasks in parallel
-        # It returns results in the order the tasks were submitted
-        results = executor.map(process_video_task, tasks)
-        
-        # Process results as they complete
-        for result in results:
-            video_id, video_db_tuple, matches_db_list, screenshots_json_dict = result
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=MAX_WORKERS,
+            initializer=init_worker,
+            initargs=(shm.name, layout), # Only the block name and array layout are pickled
+            mp_context=get_pool_context()
+            
+        ) as executor:
             
-            # Aggregate results safely in the main thread
-            all_videos_to_insert.append(video_db_tuple)
-            all_matches_to_insert.extend(matches_db_list)
+            # Start all workers up front so process startup isn't counted in the timing
+            list(executor.map(warm_up, range(MAX_WORKERS)))
+            start_time = time.perf_counter()
             
-            # Update the main JSON structure
-            if video_id in output_data:
-                output_data[video_id]['screenshots'] = screenshots_json_dict
+            # Submit MAP_CHUNKSIZE videos per pickled message, keeping at
+            # most CHUNKS_IN_FLIGHT_PER_WORKER chunks per worker pending.
+            # (executor.map would submit every chunk up front.)
+            max_in_flight = MAX_WORKERS * CHUNKS_IN_FLIGHT_PER_WORKER
+            pending = set()
+            while True:
+                while len(pending) < max_in_flight:
+                    chunk = list(islice(tasks, MAP_CHUNKSIZE))
+                    if not chunk:
+                        break
+                    pending.add(executor.submit(process_video_chunk, chunk))
+                if not pending:
+                    break
+                
+                # Process results as they complete
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    for result in future.result():
+                        video_id, video_db_tuple, timestamps, battle_rows, scores = result
+                        
+                        # Aggregate results safely in the main thread
+                        all_videos_to_insert.append(video_db_tuple)
+                        matches_db_list, screenshots_json_dict = collect_video_results(
+                            index, video_id, output_data[video_id].get('screenshots', {}),
+                            timestamps, battle_rows, scores
+                        )
+                        all_matches_to_insert.extend(matches_db_list)
+                        
+                        # Update the main JSON structure
+                        output_data[video_id]['screenshots'] = screenshots_json_dict
+    finally:
+        index = None  # release the views so the block can be closed
+        shm.close()
+        shm.unlink()
     
     end_time = time.perf_counter()
     print(f"--- Parallel processing finished in {end_time - start_time:.2f} seconds ---")
@@ -358,7 +656,16 @@ def main():
     print("\n--- Saving all matches to database ---")
     conn = sqlite3.connect(DB_NAME)
     cursor = conn.cursor()
+    # Bulk-ingest settings: WAL with relaxed syncing, and a big in-memory cache
+    cursor.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-262144;
+        PRAGMA mmap_size=268435456;
+    """)
     try:
+        # Everything below runs in a single transaction, committed once at the end
         print("Wiping 'battle_videos' table for a clean insert...")
         cursor.execute("DELETE FROM battle_videos")
         # Insert all videos
@@ -368,12 +675,13 @@ def main():
         ''', all_videos_to_insert)
         print(f"Inserted or replaced {len(all_videos_to_insert)} video entries.")
         
-        # Insert all battle/video links
-        cursor.executemany('''
-        INSERT OR REPLACE INTO battle_videos 
-        (battle_id, video_id, video_timestamp_sec, match_score, ocr_player_count, battle_player_count)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', all_matches_to_insert)
+        # Insert all battle/video links, in slices to bound parameter memory
+        for i in range(0, len(all_matches_to_insert), INSERT_BATCH_SIZE):
+            cursor.executemany('''
+            INSERT OR REPLACE INTO battle_videos 
+            (battle_id, video_id, video_timestamp_sec, match_score, ocr_player_count, battle_player_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', all_matches_to_insert[i:i + INSERT_BATCH_SIZE])
         print(f"Inserted or replaced {len(all_matches_to_insert)} screenshot matches.")
         
         conn.commit()
@@ -384,8 +692,8 @@ def main():
         conn.close()
 
     # 5. Save the modified JSON to a new file
-    with open(OUTPUT_JSON_FILE, 'w') as f:
-        json.dump(output_data, f, indent=4)
+    with open(OUTPUT_JSON_FILE, 'wb') as f:
+        f.write(orjson.dumps(output_data))
         
     print(f"\n--- Process Complete ---")
     print(f"Updated JSON with match data saved to '{OUTPUT_JSON_FILE}'.")
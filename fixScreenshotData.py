@@ -1,14 +1,28 @@
 import yt_dlp
-import json
 import os
 import re
 import sys
+import threading
+import concurrent.futures
 from yt_dlp.networking import impersonate
 
+# Much faster JSON parser/serializer for the database and its checkpoints
+# pip install orjson
+import orjson
+
+# The same per-thread YoutubeDL instances and metadata rate limit as the scraper
+from scrape import METADATA_WORKERS, thread_youtube_dl, wait_for_metadata_slot
+
 # --- CONFIGURATION ---
 # Point these to your data
 SCREENSHOT_DIR = "data/AllBarScreenshots"
 DB_FILEPATH = "data/screenshot_data.json"
+# Parallel yt-dlp lookups. The work is network bound, so threads are enough.
+# Together they start at most scrape.METADATA_REQUESTS_PER_SEC lookups per
+# second, so more threads than the scraper uses wouldn't go any faster.
+FETCH_WORKERS = METADATA_WORKERS
+# Save progress to disk after this many updates, so a crash loses at most this many fetches
+CHECKPOINT_EVERY = 100
 # --- --- --- --- ---
 
 def get_ids_from_screenshot_dir(directory):
@@ -21,15 +35,50 @@ def get_ids_from_screenshot_dir(directory):
         print(f"[ERROR] Screenshot directory not found: {directory}")
         return file_ids
 
-    for entry in os.listdir(directory):
-        if entry.endswith('.png'):
-            # Use regex to strip off the timestamp suffix
-            # e.g., "bO4DytVhO8Q_90s.png" -> "bO4DytVhO8Q"
-            video_id = re.sub(r"_\d+s\.png$", '', entry)
+    with os.scandir(directory) as it:
+        for entry in it:
+            name = entry.name
+            if not name.endswith(('.png', '.jpg')) or not entry.is_file():
+                continue
+            # Strip off the timestamp suffix
+            # e.g., "bO4DytVhO8Q_90s.jpg" -> "bO4DytVhO8Q"
+            video_id, sep, suffix = name[:-4].rpartition('_')
+            if not (sep and suffix.endswith('s') and suffix[:-1].isdigit()):
+                # Unusual name, let the regex decide
+                video_id = re.sub(r"_\d+s\.(?:png|jpg)$", '', name)
             file_ids.add(video_id.strip())
             
     return file_ids
 
+def atomic_write_json(filepath, data):
+    """
+    Writes data to a temp file next to filepath and renames it into place,
+    so a crash mid-write never leaves a truncated database.
+    """
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'wb') as f:
+        f.write(orjson.dumps(data))
+    os.replace(tmp_filepath, filepath)
+
+def fetch_video_info(video_id, ydl_opts, thread_state, instances):
+    """
+    Fetches metadata for one video on a worker thread, once the rate limit
+    allows (see scrape.wait_for_metadata_slot).
+    Each thread keeps its own YoutubeDL, since one instance isn't thread-safe.
+    Returns (status, info) where status is 'ok', 'empty', 'download_error' or 'error'.
+    """
+    ydl = thread_youtube_dl(thread_state, instances, ydl_opts)
+
+    video_url = f"https://www.youtube.com/watch?v={video_id}"
+    wait_for_metadata_slot()
+    try:
+        info = ydl.extract_info(video_url, download=False)
+        return ('ok', info) if info else ('empty', None)
+    except yt_dlp.utils.DownloadError:
+        return 'download_error', None
+    except Exception as e:
+        return 'error', e
+
 def sync_database(db_filepath, screenshot_dir):
     """
     Synchronizes the JSON database with the screenshot directory.
@@ -42,8 +91,8 @@ def sync_database(db_filepath, screenshot_dir):
     video_db = {}
     if os.path.exists(db_filepath):
         try:
-            with open(db_filepath, 'r', encoding='utf-8') as f:
-                video_db = json.load(f)
+            with open(db_filepath, 'rb') as f:
+                video_db = orjson.loads(f.read())
             if not isinstance(video_db, dict):
                 raise ValueError("Database is not a valid JSON object.")
         except Exception as e:
@@ -94,8 +143,8 @@ def sync_database(db_filepath, screenshot_dir):
     # 5. Create a backup
     backup_filepath = db_filepath + '.sync-bak'
     try:
-        with open(backup_filepath, 'w', encoding='utf-8') as f:
-            json.dump(video_db, f, indent=4, ensure_ascii=False)
+        with open(backup_filepath, 'wb') as f:
+            f.write(orjson.dumps(video_db))
         print(f"Created backup at {backup_filepath}")
     except Exception as e:
         print(f"Warning: Could not create backup file. {e}")
@@ -111,17 +160,42 @@ def sync_database(db_filepath, screenshot_dir):
     }
 
     updates_count = 0
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        for video_id in ids_to_fetch:
-            video_url = f"https://www.youtube.com/watch?v={video_id}"
-            print(f"Fetching: {video_id}...")
+    thread_state = threading.local()
+    instances = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            futures = {
+                executor.submit(fetch_video_info, video_id, ydl_opts, thread_state, instances): video_id
+                for video_id in ids_to_fetch
+            }
+            print(f"Fetching with {FETCH_WORKERS} threads...")
             
-            try:
-                info = ydl.extract_info(video_url, download=False)
+            # Results are applied here on the main thread, so video_db needs no lock
+            for future in concurrent.futures.as_completed(futures):
+                video_id = futures[future]
+                status, info = future.result()
                 
-                if not info:
+                if status == 'empty':
                     print(f"  -> Failed (no info returned): {video_id}")
                     continue
+                
+                if status == 'error':
+                    print(f"  -> Failed (Unexpected Error): {video_id}. {info}")
+                    continue
+                
+                if status == 'download_error':
+                    print(f"  -> Failed (DownloadError): {video_id}. Video likely private/deleted.")
+                    # Add placeholder data so we don't try again
+                    if video_id not in video_db or not video_db[video_id].get('title'):
+                        video_db[video_id] = {
+                            'title': 'N/A (Fetch Failed - Private/Deleted)',
+                            'upload_date': 'N/A', 'duration': 0,
+                            'uploader': 'N/A', 'tags': [], 'thumbnail': ''
+                        }
+                    updates_count += 1
+                    if updates_count % CHECKPOINT_EVERY == 0:
+                        atomic_write_json(db_filepath, video_db)
+                    continue
 
                 # Create the data payload (same as in your main script)
                 video_data = {
@@ -137,28 +211,21 @@ def sync_database(db_filepath, screenshot_dir):
                 video_db[video_id] = video_data
                 print(f"  -> Synced: {info.get('title')}")
                 updates_count += 1
-
-            except yt_dlp.utils.DownloadError as e:
-                print(f"  -> Failed (DownloadError): {video_id}. Video likely private/deleted.")
-                # Add placeholder data so we don't try again
-                if video_id not in video_db or not video_db[video_id].get('title'):
-                    video_db[video_id] = {
-                        'title': 'N/A (Fetch Failed - Private/Deleted)',
-                        'upload_date': 'N/A', 'duration': 0,
-                        'uploader': 'N/A', 'tags': [], 'thumbnail': ''
-                    }
-                updates_count += 1
-            
-            except Exception as e:
-                print(f"  -> Failed (Unexpected Error): {video_id}. {e}")
+                
+                # Checkpoint from the main thread so long runs survive a crash
+                if updates_count % CHECKPOINT_EVERY == 0:
+                    print(f"Checkpoint: saving {updates_count} updates to {db_filepath}...")
+                    atomic_write_json(db_filepath, video_db)
+    finally:
+        for ydl in instances:
+            ydl.close()
 
     # 7. Save the updated database
     if updates_count > 0:
         print(f"\nTotal updates made: {updates_count}.")
         print(f"Saving synchronized database to {db_filepath}...")
         try:
-            with open(db_filepath, 'w', encoding='utf-8') as f:
-                json.dump(video_db, f, indent=4, ensure_ascii=False)
+            atomic_write_json(db_filepath, video_db)
             print("Save complete.")
         except Exception as e:
             print(f"FATAL ERROR: Could not write updates to '{db_filepath}'. {e}")
@@ -120,8 +120,9 @@ document.addEventListener('DOMContentLoaded', () => {
             loadingEl.innerText = 'Indexing data...';
             
             // OCR Searcher (existing)
+            // ocr_index rows are [ocr_name, video_id, timestamp]
             const ocrOptions = {
-                keys: ['ocr_name'],
+                keys: [{ name: 'ocr_name', getFn: (row) => row[0] }],
                 includeScore: true,
                 threshold: 0.4,
             };
@@ -457,7 +458,9 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         
         const tableRows = results.map(result => {
-            const item = result.item;
+            const [ocr_name, video_id, timestamp] = result.item;
+            const meta = allData.videos_meta[video_id] || {};
+            const item = { ocr_name, video_id, timestamp, ...meta };
             const ytLink = `https://www.youtube.com/watch?v=${item.video_id}`;
             const thumbUrl = `https://i.ytimg.com/vi/${item.video_id}/mqdefault.jpg`;
             
@@ -1,23 +1,114 @@
 import cv2
+import numpy as np
 from pathlib import Path
 from rapidocr import RapidOCR
 import re
 import os
-import json  # Added for JSON output
+import importlib.util
 from ultralytics import YOLO
+from ultralytics.nn.autobackend import AutoBackend
 import torch
-import multiprocessing as mp
+import torch.nn.functional as F
+try:
+    from ultralytics.utils.nms import non_max_suppression
+except ImportError:  # older ultralytics releases
+    from ultralytics.utils.ops import non_max_suppression
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Much faster JSON parser/serializer for the staged results and final merge
+# pip install orjson
+import orjson
 
 DEBUG_MODE = False
+# Print the per-screenshot details (file, detections, OCR text). Off by default:
+# printing several lines per screenshot from every thread slows the pipeline down.
+VERBOSE = DEBUG_MODE
+# Without VERBOSE, progress is printed once per this many saved results
+PROGRESS_EVERY = 100
 # YOLO model path for UI panel detection (pretrained)
 MODEL_PATH = "ui_detector.pt"  # change if your trained model is elsewhere
+# TensorRT FP16 engine exported from MODEL_PATH on first use. Only used when the
+# tensorrt package and a CUDA build of torch are installed; otherwise (e.g. on
+# AMD GPUs) the PyTorch model is used and nothing is exported.
+# The engine is built for YOLO_IMG_SIZE and YOLO_BATCH_SIZE; delete it after changing either.
+USE_TENSORRT = True
+ENGINE_PATH = str(Path(MODEL_PATH).with_suffix('.engine'))
 # YOLO confidence threshold
 YOLO_CONF_THRESHOLD = 0.80
-NUM_THREADS = 4
+# Lower NMS threshold, so weak detections are still reported as rejected
+YOLO_NMS_CONF = 0.25
+# Run the detector on the bottom-right ROI crop at 320px instead of the full
+# frame at 640px. Must match ROI_DETECTOR in bbox.py when MODEL_PATH was
+# trained: the shipped ui_detector.pt is a full-frame model, so this stays off
+# until it is retrained on the crop. Delete ENGINE_PATH after changing it.
+ROI_DETECTOR = False
+ROI_START_X = 0.75
+ROI_START_Y = 0.25
+YOLO_IMG_SIZE = 320 if ROI_DETECTOR else 640
+# Max screenshots per batched YOLO call. A smaller batch is launched once the
+# oldest waiting screenshot has waited YOLO_BATCH_TIMEOUT seconds.
+YOLO_BATCH_SIZE = 8
+YOLO_BATCH_TIMEOUT = 0.05
+# Dummy batches run at startup so cuDNN autotuning and CUDA graph capture
+# happen before the first real batch
+YOLO_WARMUP_RUNS = 3
+# Number of OCR threads (RapidOCR runs on the CPU). One core is left for the
+# loader and YOLO threads, and each OCR engine is single-threaded so the
+# threads don't oversubscribe the cores.
+NUM_THREADS = max(1, (os.cpu_count() or 2) - 1)
+OCR_ENGINE_PARAMS = {
+    "EngineConfig.onnxruntime.intra_op_num_threads": 1,
+    "EngineConfig.onnxruntime.inter_op_num_threads": 1,
+}
+# UI panels OCR'd together in one RapidOCR call. The panels are stacked into one
+# image, OCR_BATCH_GAP pixels apart. A stack is never taller than
+# OCR_MAX_CANVAS_SIDE (RapidOCR's Global.max_side_len), as RapidOCR shrinks
+# bigger images, which would make the text smaller than on a lone panel.
+# Stacking can still change what the detector finds, so it stays off (1)
+# until its accuracy has been compared against OCRing panels one by one.
+OCR_BATCH_SIZE = 1
+OCR_BATCH_TIMEOUT = 0.05
+OCR_BATCH_GAP = 32
+OCR_MAX_CANVAS_SIDE = 2000
+# Max screenshots waiting between pipeline stages
+QUEUE_SIZE = 32
+# Threads reading screenshot files ahead of the decoder, and how many reads may be outstanding
+LOADER_THREADS = 8
+MAX_READS_IN_FLIGHT = 32
 
 SCREENSHOTS_DIR = "data/AllBarScreenshots"
 # Define the JSON output file
 JSON_OUTPUT_FILE = "data/screenshot_data.json"
+# Screenshot file names look like '<video_id>_<seconds>s.jpg' (or .png from older scrapes)
+SCREENSHOT_EXTENSIONS = ('.png', '.jpg')
+SCREENSHOT_NAME_PATTERN = re.compile(r"^(.*)_(\d+)s\.(?:png|jpg)$")
+# Clan tags at start of string like [tag]name, (tag)name, {tag}name
+CLAN_TAG_PATTERN = re.compile(r'^[\[\(\{]([^\]\)\}]+)[\]\)\}]\s*(.+)$')
+# Leading digits, whitespace and CJK characters OCR picks up before a name
+LEADING_JUNK_PATTERN = re.compile(r'^[0-9\s\u4e00-\u9fff]*')
+# UI labels that are never gamertags (enemies, spectators, units/, units:, total:, fps, ...)
+STOPWORD_PATTERN = re.compile(r'enemies|spectators|units|total|fps')
+
+
+class GamertagCharFilter(dict):
+    """
+    str.translate table that keeps letters, digits and _ - [ ] ( )
+    and deletes every other character.
+    """
+    def __missing__(self, codepoint):
+        return None
+
+GAMERTAG_CHARS = GamertagCharFilter(
+    (ord(c), ord(c))
+    for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-[]()'
+)
+# New results are appended here (one JSON object per line) while running,
+# then merged into JSON_OUTPUT_FILE once at the end or on the next start.
+JSONL_STAGING_FILE = "data/screenshot_data.jsonl"
 
 
 def strip_clan_tag(text):
@@ -30,8 +121,7 @@ def strip_clan_tag(text):
         return text, None
     text = text.strip('*').strip()
     # Match clan tags at start of string like [tag]name, (tag)name, {tag}name
-    pattern = r'^[\[\(\{]([^\]\)\}]+)[\]\)\}]\s*(.+)$'
-    match = re.match(pattern, text)
+    match = CLAN_TAG_PATTERN.match(text)
     if match:
         clan_tag = match.group(1)
         username = match.group(2)
@@ -43,8 +133,10 @@ def show_debug_image(image, title, box_coords=None):
     Helper function to show a scaled-down debug image.
     """
     try:
-        debug_img = image.copy()
+        # Only copy when drawing on the image; the caller's array is left untouched
+        debug_img = image
         if box_coords:
+            debug_img = image.copy()
             (startX, startY, W, H) = box_coords
             cv2.rectangle(debug_img, (startX, startY), (W - 1, H - 1), (0, 0, 255), 2)
         (img_H, img_W) = debug_img.shape[:2]
@@ -67,45 +159,116 @@ def show_debug_image(image, title, box_coords=None):
     except Exception as e:
         print(f"An error occurred in show_debug_image: {e}")
 
-def find_ui_panel(screenshot, yolo_model):
+def best_detections(dets):
+    """
+    Picks the highest confidence box of every image's detections on the GPU
+    and copies them to the host in one transfer, instead of syncing per image.
+    dets is the per-image list of (n, 6) [x1, y1, x2, y2, conf, cls] tensors
+    from NMS. Returns a [x1, y1, x2, y2, conf, cls] list or None per image.
+    """
+    if not dets:
+        return []
+    empty = dets[0].new_zeros(6)
+    best = torch.stack([det[det[:, 4].argmax()] if len(det) > 0 else empty for det in dets])
+    return [
+        row if len(det) > 0 else None
+        for row, det in zip(best.float().tolist(), dets)
+    ]
+
+def pick_ui_box(best, letterbox, W, H, crop_x, crop_y):
+    """
+    Picks the UI panel from the best detection on one image's letterboxed
+    detector input (the ROI crop with ROI_DETECTOR, else the full frame).
+    best is the [x1, y1, x2, y2, conf, cls] list from best_detections, or None.
+    Returns: (startX, startY, endX, endY) in full-frame coordinates or None
+    """
+    if best is not None:
+        best_conf = best[4]
+        if best_conf > YOLO_CONF_THRESHOLD:
+            # Undo the letterbox to get crop coordinates
+            scale, pad_x, pad_y = letterbox
+            x1, x2 = [int((v - pad_x) / scale) for v in (best[0], best[2])]
+            y1, y2 = [int((v - pad_y) / scale) for v in (best[1], best[3])]
+            # Shift from crop coordinates back to the full frame
+            x1, x2 = x1 + crop_x, x2 + crop_x
+            y1, y2 = y1 + crop_y, y2 + crop_y
+            # Sanity check
+            x1 = max(0, min(x1, W - 1))
+            x2 = max(0, min(x2, W - 1))
+            y1 = max(0, min(y1, H - 1))
+            y2 = max(0, min(y2, H - 1))
+            # If the detected box is reasonably on the right side, accept
+            if x1 > W * 0.5:
+                if VERBOSE:
+                    print(f"UI Panel detected by YOLO at ({x1},{y1},{x2},{y2}) conf={best_conf:.3f}")
+                return (x1, y1, x2, y2)
+            elif VERBOSE:
+                print("YOLO detected a box but it's not on the expected right-side region.")
+        elif VERBOSE:
+            print(f"No YOLO detection with confidence > {YOLO_CONF_THRESHOLD}.")
+    return None
+
+def letterbox_on_gpu(crops, size, device, dtype):
+    """
+    Uploads uint8 BGR crops and letterboxes them into one (N, 3, size, size)
+    RGB 0-1 batch on the device, N being at least YOLO_BATCH_SIZE (unused
+    slots stay blank). Resizing, channel swap and normalizing all run
+    on the GPU; only the small uint8 crops cross the bus.
+    Returns the batch and a (scale, pad_x, pad_y) per crop.
+    """
+    # Same grey padding as the ultralytics letterbox
+    batch_size = max(len(crops), YOLO_BATCH_SIZE)
+    batch = torch.full((batch_size, 3, size, size), 114 / 255.0, device=device, dtype=dtype)
+    letterboxes = []
+    for i, crop in enumerate(crops):
+        h, w = crop.shape[:2]
+        scale = min(size / h, size / w)
+        new_h, new_w = round(h * scale), round(w * scale)
+        pad_y, pad_x = (size - new_h) // 2, (size - new_w) // 2
+        
+        t = torch.from_numpy(np.ascontiguousarray(crop))
+        if device.type == 'cuda':
+            t = t.pin_memory()
+        t = t.to(device, non_blocking=True)
+        # HWC BGR uint8 -> 1CHW RGB float
+        t = t.flip(-1).permute(2, 0, 1).unsqueeze(0).to(dtype) / 255.0
+        t = F.interpolate(t, size=(new_h, new_w), mode='bilinear', align_corners=False)
+        batch[i, :, pad_y:pad_y + new_h, pad_x:pad_x + new_w] = t[0]
+        letterboxes.append((scale, pad_x, pad_y))
+    return batch, letterboxes
+
+def find_ui_panels(screenshots, yolo_model):
     """
-    Finds the right-side UI panel using YOLO.
-    Returns: (startX, startY, endX, endY) or None if no detection with conf > 0.92
+    Finds the right-side UI panel in several screenshots with one batched YOLO call.
+    yolo_model is the raw network from load_yolo_model. Preprocessing runs on
+    the GPU and the network is called directly, bypassing the ultralytics predictor.
+    Returns: a list with (startX, startY, endX, endY) or None per screenshot
     """
-    (H, W) = screenshot.shape[:2]
-    # Run YOLO
+    crops = []
+    offsets = []
+    for screenshot in screenshots:
+        (H, W) = screenshot.shape[:2]
+        if ROI_DETECTOR:
+            crop_x = int(W * ROI_START_X)
+            crop_y = int(H * ROI_START_Y)
+        else:
+            crop_x = crop_y = 0
+        crops.append(screenshot[crop_y:H, crop_x:W])
+        offsets.append((W, H, crop_x, crop_y))
+    # Run YOLO on all of them in one batch
     try:
-        results = yolo_model(screenshot, verbose=False)
-        if results and len(results) > 0:
-            boxes = results[0].boxes
-            if boxes is not None and len(boxes) > 0:
-                # Pick the box with highest confidence
-                best = None
-                best_conf = -1.0
-                for b in boxes:
-                    conf = float(b.conf[0]) if hasattr(b, "conf") else 0.0
-                    if conf > best_conf:
-                        best_conf = conf
-                        best = b
-                if best is not None and best_conf > YOLO_CONF_THRESHOLD:
-                    xyxy = best.xyxy[0].tolist()
-                    x1, y1, x2, y2 = map(int, xyxy)
-                    # Sanity check
-                    x1 = max(0, min(x1, W - 1))
-                    x2 = max(0, min(x2, W - 1))
-                    y1 = max(0, min(y1, H - 1))
-                    y2 = max(0, min(y2, H - 1))
-                    # If the detected box is reasonably on the right side, accept
-                    if x1 > W * 0.5:
-                        print(f"UI Panel detected by YOLO at ({x1},{y1},{x2},{y2}) conf={best_conf:.3f}")
-                        return (x1, y1, x2, y2)
-                    else:
-                        print("YOLO detected a box but it's not on the expected right-side region.")
-                else:
-                    print(f"No YOLO detection with confidence > {YOLO_CONF_THRESHOLD}.")
+        # load_yolo_model always returns an FP16 network on the GPU
+        with torch.inference_mode():
+            batch, letterboxes = letterbox_on_gpu(crops, YOLO_IMG_SIZE, torch.device('cuda'), torch.half)
+            preds = yolo_model(batch)
+            dets = non_max_suppression(preds, conf_thres=YOLO_NMS_CONF)[:len(crops)]
+        return [
+            pick_ui_box(best, letterbox, *offset)
+            for best, letterbox, offset in zip(best_detections(dets), letterboxes, offsets)
+        ]
     except Exception as e:
         print(f"Warning: YOLO inference failed: {e}")
-    return None
+    return [None] * len(screenshots)
 
 def is_gamertag_candidate(text):
     """
@@ -120,18 +283,10 @@ def is_gamertag_candidate(text):
         return False
     raw = text.strip()
     # Reject obvious UI labels or short tokens
-    stoplist = {
-        'enemies', 'spectators', 'units', 'total', 'fps', 'units/', 'units:', 'total:', 'spectators:',
-    }
-    low = raw.lower()
-    if low in stoplist:
+    if STOPWORD_PATTERN.search(raw.lower()):
         return False
-    
-    for element in stoplist:
-        if element in low:
-            return False
     # Clean to allow letters, digits, _ - [ ] ( ) and remove trailing punctuation
-    cleaned = re.sub(r'[^A-Za-z0-9_\-\[\]\(\)]', '', raw)
+    cleaned = raw.translate(GAMERTAG_CHARS)
     
     if len(cleaned) < 3 or len(cleaned) > 24:
         return False
@@ -142,22 +297,14 @@ def is_gamertag_candidate(text):
         return False
     return True
 
-def ocr_bottom_right_element(screenshot_path: str, debug=False, reader=None, yolo_model=None):
+def crop_ui_panel(screenshot, ui_bounds, screenshot_path, debug=False):
     """
-    Finds the UI element using YOLO, runs PP on the ROI,
-    filters OCR outputs to probable gamertags, then fuzzy matches results against the username database.
-    
-    MODIFIED: This version expects 'reader' to be a RapidOCR engine instance.
+    Returns the UI panel region of a screenshot as a view,
+    or None if there is no usable panel.
     """
-    screenshot = cv2.imread(str(screenshot_path))
-    if screenshot is None:
-        raise FileNotFoundError(f"Screenshot not found or is corrupt at {screenshot_path}")
-    (H, W) = screenshot.shape[:2]
-
-    # --- Find UI Panel using YOLO ---
-    ui_bounds = find_ui_panel(screenshot, yolo_model)
     if ui_bounds is None:
-        print(f"Could not find UI panel in {screenshot_path}. Skipping.")
+        if VERBOSE:
+            print(f"Could not find UI panel in {screenshot_path}. Skipping.")
         if debug:
             show_debug_image(screenshot, f"Skipped (No UI): {Path(screenshot_path).name}")
         return None
@@ -166,50 +313,126 @@ def ocr_bottom_right_element(screenshot_path: str, debug=False, reader=None, yol
     
     # Ensure valid ROI
     if startX >= endX or startY >= endY:
-        print("Invalid UI bounds detected, skipping.")
+        if VERBOSE:
+            print("Invalid UI bounds detected, skipping.")
         return None
     
     roi_color = screenshot[startY:endY, startX:endX]
     
     if roi_color.shape[0] < 30 or roi_color.shape[1] < 30:
-        print("ROI too small, skipping.")
+        if VERBOSE:
+            print("ROI too small, skipping.")
         return None
 
-    # --- Run OCR on ROI (Modified for RapidOCR) ---
-    roi_for_ocr = roi_color.copy()
-    print(f"Running OCR on ROI of size {roi_for_ocr.shape}...")
-    try:
-        # --- NEW FIX ---
-        # 1. Call the reader, which returns a single RapidOCROutput object
-        ocr_result_object = reader(roi_for_ocr) 
+    return roi_color
 
-        # 2. Check if the object is valid and has detected text
-        if ocr_result_object and ocr_result_object.txts:
-            
-            # 3. Zip the parallel lists (boxes, txts, scores) into the 
-            #    (bbox, text, prob) tuple format that the rest of the 
-            #    script expects.
-            results = list(zip(
-                ocr_result_object.boxes, 
-                ocr_result_object.txts, 
-                ocr_result_object.scores
-            ))
+def ocr_stacked(rois, reader):
+    """
+    OCRs several UI panels with a single RapidOCR call by stacking them
+    vertically into one image, then splits the detections back per panel.
+    Returns one list of (bbox, text, prob) tuples per ROI, with each bbox
+    in the coordinates of its own ROI. Raises if RapidOCR fails.
+    """
+    if len(rois) == 1:
+        canvas = rois[0]
+        offsets = [0]
+    else:
+        width = max(roi.shape[1] for roi in rois)
+        height = sum(roi.shape[0] for roi in rois) + OCR_BATCH_GAP * (len(rois) - 1)
+        canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        offsets = []
+        y = 0
+        for roi in rois:
+            canvas[y:y + roi.shape[0], :roi.shape[1]] = roi
+            offsets.append(y)
+            y += roi.shape[0] + OCR_BATCH_GAP
+
+    if VERBOSE:
+        print(f"Running OCR on {len(rois)} ROI(s), image size {canvas.shape}...")
+    batch_results = [[] for _ in rois]
+    # RapidOCR returns a single RapidOCROutput object. RapidOCR does not
+    # write to its input, so a lone ROI view is passed as is.
+    ocr_result_object = reader(canvas)
+
+    # Check if the object is valid and has detected text
+    if ocr_result_object and ocr_result_object.txts:
+        # Zip the parallel lists (boxes, txts, scores) into the
+        # (bbox, text, prob) tuple format that the rest of the
+        # script expects, assigning each box to the ROI it lies in.
+        for bbox, text, prob in zip(
+            ocr_result_object.boxes,
+            ocr_result_object.txts,
+            ocr_result_object.scores
+        ):
+            bbox = np.asarray(bbox, dtype=np.float32)
+            center_x, center_y = bbox.mean(axis=0)
+            i = int(np.searchsorted(offsets, center_y, side='right')) - 1
+            if i < 0 or center_y >= offsets[i] + rois[i].shape[0] or center_x >= rois[i].shape[1]:
+                continue  # In the padding between ROIs
+            bbox[:, 1] -= offsets[i]
+            batch_results[i].append((bbox, text, prob))
+
+    return batch_results
+
+def group_rois(rois):
+    """
+    Splits the ROIs into runs that each stack into an image no taller
+    than OCR_MAX_CANVAS_SIDE. A ROI taller than that is a run of its own.
+    """
+    groups = []
+    height = 0
+    for roi in rois:
+        if groups and height + OCR_BATCH_GAP + roi.shape[0] <= OCR_MAX_CANVAS_SIDE:
+            groups[-1].append(roi)
+            height += OCR_BATCH_GAP + roi.shape[0]
         else:
-            # No text found, set results to an empty list
-            results = []
-        # --- End FIX ---
-        
-    except Exception as e:
-        print(f"OCR failure: {e}")
-        results = []
+            groups.append([roi])
+            height = roi.shape[0]
+    return groups
+
+def run_ocr_batch(rois, reader):
+    """
+    OCRs a batch of UI panels, stacking as many as fit together under
+    OCR_MAX_CANVAS_SIDE into each RapidOCR call. If a stacked call fails,
+    its panels are retried one by one, so one bad panel only loses itself.
+    Returns one list of (bbox, text, prob) tuples per ROI.
+    """
+    batch_results = []
+    for group in group_rois(rois):
+        try:
+            batch_results.extend(ocr_stacked(group, reader))
+        except Exception as e:
+            print(f"OCR failure: {e}")
+            if len(group) == 1:
+                batch_results.append([])
+                continue
+            print(f"Retrying the {len(group)} stacked panels one by one.")
+            for roi in group:
+                try:
+                    batch_results.extend(ocr_stacked([roi], reader))
+                except Exception as e:
+                    print(f"OCR failure: {e}")
+                    batch_results.append([])
+    return batch_results
+
+def read_gamertags(screenshot, ui_bounds, roi_color, results, screenshot_path, debug=False):
+    """
+    Filters the OCR results of a UI panel to probable gamertags
+    and returns them (or None).
+    """
+    (startX, startY, endX, endY) = ui_bounds
+    # Debug mode draws the candidates onto the ROI and needs its own copy
+    roi_for_ocr = roi_color.copy() if debug else roi_color
 
     if not results:
-        print(f"No text found in {screenshot_path}. Skipping.")
+        if VERBOSE:
+            print(f"No text found in {screenshot_path}. Skipping.")
         if debug:
             show_debug_image(screenshot, f"Skipped (No Text): {Path(screenshot_path).name}", box_coords=(startX, startY, endX, endY))
         return None
     
-    print(f"Found {len(results)} text elements via OCR")
+    if VERBOSE:
+        print(f"Found {len(results)} text elements via OCR")
     
     # --- Filter OCR outputs for gamertag candidates ---
     # (This section will now work correctly)
@@ -226,20 +449,20 @@ def ocr_bottom_right_element(screenshot_path: str, debug=False, reader=None, yol
             # Keep bounding boxes for possible debug visualization
             candidates.append((bbox, t, prob))
 
-    print(f"After gamertag filtering: {len(candidates)} candidates")
+    if VERBOSE:
+        print(f"After gamertag filtering: {len(candidates)} candidates")
     
     if not candidates:
         if debug:
             show_debug_image(roi_color, "No Gamertag Candidates", box_coords=(startX, startY, endX, endY))
         return None
 
-    # Sort candidates top-to-bottom, left-to-right (by y then x)
-    # (No changes needed here, bbox structure is compatible)
-    def bbox_top_left(bbox):
-        (tl, tr, br, bl) = bbox
-        return (int(tl[1]), int(tl[0]))
-    
-    candidates.sort(key=lambda x: bbox_top_left(x[0]))
+    # Sort candidates top-to-bottom, left-to-right (by the y then x of the
+    # top-left corner, truncated to whole pixels) with one stable numpy sort
+    if len(candidates) > 1:
+        top_lefts = np.array([c[0][0] for c in candidates]).astype(np.int64)
+        order = np.lexsort((top_lefts[:, 0], top_lefts[:, 1]))
+        candidates = [candidates[i] for i in order]
 
     if debug:
         for (bbox, dirty_text, prob) in candidates:
@@ -263,11 +486,12 @@ def ocr_bottom_right_element(screenshot_path: str, debug=False, reader=None, yol
                             cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 100), 1)
     final_text = []
     for candidate in candidates:
-        final_text.append(re.sub(r'^[0-9\s\u4e00-\u9fff]*', '', candidate[1]))
+        final_text.append(LEADING_JUNK_PATTERN.sub('', candidate[1]))
     
-    print(f"--- Found Gamertags in {screenshot_path} ---")
-    print(final_text if final_text else "(No gamertags detected)")
-    print("--------------------------------------------------\n")
+    if VERBOSE:
+        print(f"--- Found Gamertags in {screenshot_path} ---")
+        print(final_text if final_text else "(No gamertags detected)")
+        print("--------------------------------------------------\n")
 
     if debug:
         # (No changes needed here)
@@ -289,104 +513,350 @@ def ocr_bottom_right_element(screenshot_path: str, debug=False, reader=None, yol
 
     return final_text if final_text else None
 
-def init_pool(initialData, lock):
-    global yolo_model, reader, worker_data, worker_lock
-    worker_data = initialData
-    worker_lock = lock
-    reader = RapidOCR()
-    if Path(MODEL_PATH).exists():
-        try:
-            print(f"Loading YOLO model from {MODEL_PATH} in process {os.getpid()}...")
-            yolo_model = YOLO(MODEL_PATH)
-            yolo_model.to('cuda')
-            print(f"YOLO model loaded in process {os.getpid()}.")
-        except Exception as e:
-            print(f"Warning: Failed to load YOLO model '{MODEL_PATH}' in process {os.getpid()}: {e}")
-            yolo_model = None
-    else:
-        print(f"YOLO model not found at {MODEL_PATH} in process {os.getpid()}. Cannot proceed without YOLO.")
-        yolo_model = None
+def load_tensorrt_engine():
+    """
+    Loads the TensorRT FP16 engine of the UI panel detector, exporting it
+    from MODEL_PATH first if it doesn't exist yet.
+    Returns the engine backend, or None if TensorRT isn't available.
+    """
+    # Without these the export can't work, and Ultralytics would try to
+    # pip install tensorrt in the middle of the run
+    if importlib.util.find_spec('tensorrt') is None or not torch.version.cuda:
+        print("TensorRT or CUDA not available, using the PyTorch model.")
+        return None
+    try:
+        if not Path(ENGINE_PATH).exists():
+            print(f"Exporting {MODEL_PATH} to a TensorRT engine (one time only)...")
+            YOLO(MODEL_PATH).export(format='engine', half=True, imgsz=YOLO_IMG_SIZE, batch=YOLO_BATCH_SIZE)
+        print(f"Loading TensorRT engine from {ENGINE_PATH}...")
+        net = AutoBackend(ENGINE_PATH, device=torch.device('cuda'), fp16=True)
+        print("TensorRT engine loaded.")
+        return net
+    except Exception as e:
+        print(f"Warning: TensorRT engine unavailable, using the PyTorch model: {e}")
+        return None
 
-def process_file(path, DEBUG_MODE):
-    global reader, yolo_model, worker_data, worker_lock
+def load_yolo_model():
+    """
+    Loads the UI panel detector onto the GPU as a TensorRT FP16 engine, or
+    else as a fused FP16 network (compiled with torch.compile where supported).
+    Returns the raw detection network, or None if it can't be loaded.
+    """
+    # Let cuDNN pick the fastest kernels for the fixed YOLO input size
+    torch.backends.cudnn.benchmark = True
+    torch.set_float32_matmul_precision('high')
+    # YOLO runs on the GPU; keep torch's CPU thread pool from competing
+    # with the OCR threads for cores
+    torch.set_num_threads(1)
+    # Batches are always letterboxed to YOLO_IMG_SIZE and padded to
+    # YOLO_BATCH_SIZE, so this is the only input shape the network ever sees
+    dummy = torch.zeros((YOLO_BATCH_SIZE, 3, YOLO_IMG_SIZE, YOLO_IMG_SIZE), device='cuda', dtype=torch.half)
+    if USE_TENSORRT and (Path(ENGINE_PATH).exists() or Path(MODEL_PATH).exists()):
+        engine = load_tensorrt_engine()
+        if engine is not None:
+            warm_up_yolo(engine, dummy)
+            return engine
+    if not Path(MODEL_PATH).exists():
+        print(f"YOLO model not found at {MODEL_PATH}. Cannot proceed without YOLO.")
+        return None
     try:
-        # Parse path to get video_id and timestamp
-        pattern = re.compile(r"^(.*)_(\d+)s\.png$")
-        match = pattern.match(path.name)
-
-        if match:
-            # Extract the captured groups
-            video_id = match.group(1)
-            timestamp = match.group(2)
-
-            print(f"File: {str(path)}")
-            print(f"  > Video ID: {video_id}")
-            print(f"  > Timestamp: {timestamp}")
-        else:
-            print(f"File: {str(path)} (No match)")
-        
-        screenshots = (worker_data.get(video_id, {})).get('screenshots', {})
-        if timestamp in screenshots:
-            print(f"Skipping {path.name}: Already processed.")
-            return
-        if yolo_model is None:
-            print(f"Skipping {path}: YOLO model not loaded.")
-            return
-            
-        results = ocr_bottom_right_element(str(path), debug=DEBUG_MODE, reader=reader, yolo_model=yolo_model)
+        print(f"Loading YOLO model from {MODEL_PATH}...")
+        yolo_model = YOLO(MODEL_PATH)
+        # Merge Conv+BN layers, then run in half precision on the GPU
+        yolo_model.fuse()
+        yolo_model.to('cuda')
+        # find_ui_panels calls the network directly, so put it in inference mode here
+        net = yolo_model.model.eval().half()
+        print("YOLO model loaded.")
+    except Exception as e:
+        print(f"Warning: Failed to load YOLO model '{MODEL_PATH}': {e}")
+        return None
+    try:
+        # The static shape lets the CUDA graph from 'reduce-overhead' be reused for every call
+        compiled = torch.compile(net, mode='reduce-overhead')
+        # Compilation is lazy; trigger it now so a failure falls back to eager
+        with torch.inference_mode():
+            compiled(dummy)
+        net = compiled
+    except Exception as e:
+        print(f"Warning: torch.compile unavailable, running YOLO eagerly: {e}")
+    warm_up_yolo(net, dummy)
+    return net
+
+def warm_up_yolo(net, dummy):
+    """Runs YOLO_WARMUP_RUNS dummy batches so kernel selection happens before real work."""
+    with torch.inference_mode():
+        for _ in range(YOLO_WARMUP_RUNS):
+            net(dummy)
+    torch.cuda.synchronize()
+
+def iter_screenshot_files(directory):
+    """
+    Yields (file name, path string) for every screenshot under directory.
+    Walks the tree with os.scandir, so no Path object is built per file.
+    """
+    dirs = [directory]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    dirs.append(entry.path)
+                elif entry.name.endswith(SCREENSHOT_EXTENSIONS):
+                    yield entry.name, entry.path
+
+def find_pending_screenshots(files, processed_data):
+    """
+    Parses '<video_id>_<seconds>s.jpg' names from the (file name, path) pairs
+    in files and drops the screenshots that already have results, before
+    any work is queued.
+    Returns a list of (path, video_id, timestamp) and the number of files seen.
+    """
+    done_set = frozenset(
+        (video_id, timestamp)
+        for video_id, video in processed_data.items()
+        for timestamp in video.get('screenshots', {})
+    )
+    pending = []
+    skipped = 0
+    total = 0
+    for name, path in files:
+        total += 1
+        match = SCREENSHOT_NAME_PATTERN.match(name)
+        if not match:
+            if VERBOSE:
+                print(f"File: {str(path)} (No match)")
+            continue
+        # Extract the captured groups
+        video_id = match.group(1)
+        timestamp = match.group(2)
         
-        if results:
-            # Use lock to safely read/write to the JSON
-            with worker_lock:
-                # Read existing data
-                data = {}
-                if Path(JSON_OUTPUT_FILE).exists():
-                    try:
-                        with open(JSON_OUTPUT_FILE, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                    except json.JSONDecodeError:
-                        print(f"Warning: {JSON_OUTPUT_FILE} is corrupt, starting fresh.")
-                        data = {}
-                
-                # Update data structure
-                if video_id not in data:
-                    data[video_id] = {}
-                if "screenshots" not in data[video_id]:
-                    data[video_id]["screenshots"] = {} # Ensure screenshots dict exists
-                    
-                # Add the new OCR result
-                data[video_id]["screenshots"][timestamp] = results
-                
-                # Write the updated data back to the file
+        if (video_id, timestamp) in done_set:
+            skipped += 1
+            continue
+        pending.append((Path(path), video_id, timestamp))
+    print(f"Skipping {skipped} screenshots: Already processed.")
+    return pending, total
+
+def save_result(staging_file, video_id, timestamp, results):
+    """
+    Appends one screenshot's gamertags to the JSONL staging file.
+    Only called from the writer thread, so no lock is needed.
+    """
+    line = orjson.dumps({"video_id": video_id, "ts": timestamp, "tags": results})
+    staging_file.write(line + b"\n")
+    # Flush per result so a crash loses at most the line being written
+    staging_file.flush()
+
+def apply_staged_results(data):
+    """Adds every result in the JSONL staging file to data. Returns how many were added."""
+    if not Path(JSONL_STAGING_FILE).exists():
+        return 0
+    count = 0
+    with open(JSONL_STAGING_FILE, 'rb') as f:
+        for line in f:
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                print(f"Warning: skipping a truncated line in {JSONL_STAGING_FILE}.")
+                continue
+            # Update data structure, ensuring the screenshots dict exists
+            video = data.setdefault(entry["video_id"], {})
+            video.setdefault("screenshots", {})[entry["ts"]] = entry["tags"]
+            count += 1
+    return count
+
+def flush_staged_results(filepath, data):
+    """
+    Merges the staged results into data, writes the whole JSON file once
+    (atomically) and removes the staging file.
+    """
+    count = apply_staged_results(data)
+    if count:
+        print(f"Merging {count} staged results into {filepath}...")
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_SORT_KEYS))
+    os.replace(tmp_filepath, filepath)
+    if Path(JSONL_STAGING_FILE).exists():
+        os.remove(JSONL_STAGING_FILE)
+
+# --- Pipeline stages ---
+# loader -> YOLO -> OCR threads -> writer, connected by bounded queues.
+# None is the end-of-stream marker passed down the pipeline.
+
+def loader_stage(pending, load_queue):
+    """
+    Stage A: reads the screenshots that still need processing from disk.
+    File reads are prefetched on a thread pool, keeping up to
+    MAX_READS_IN_FLIGHT outstanding, and decoded in order with cv2.imdecode.
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=LOADER_THREADS) as loader_pool:
+            items = iter(pending)
+            in_flight = deque()
+
+            def submit_next():
+                item = next(items, None)
+                if item is not None:
+                    in_flight.append((item, loader_pool.submit(Path.read_bytes, item[0])))
+
+            for _ in range(MAX_READS_IN_FLIGHT):
+                submit_next()
+
+            while in_flight:
+                (path, video_id, timestamp), future = in_flight.popleft()
+                submit_next()
                 try:
-                    with open(JSON_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, indent=4, sort_keys=True)
+                    if VERBOSE:
+                        print(f"File: {str(path)}")
+                        print(f"  > Video ID: {video_id}")
+                        print(f"  > Timestamp: {timestamp}")
+
+                    data = future.result()
+                    screenshot = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                    if screenshot is None:
+                        raise FileNotFoundError(f"Screenshot not found or is corrupt at {path}")
+                    load_queue.put((path, video_id, timestamp, screenshot))
+                except OSError as e:
+                    print(e)
                 except Exception as e:
-                    print(f"CRITICAL: Failed to write to {JSON_OUTPUT_FILE}: {e}")
+                    print(f"An error occurred on file {path}: {e}")
+    finally:
+        load_queue.put(None)
 
-    except FileNotFoundError as e:
-        print(e)
-    except Exception as e:
-        print(f"An error occurred on file {path}: {e}")
+def yolo_stage(yolo_model, load_queue, ocr_queue, num_ocr_threads, debug):
+    """
+    Stage B: finds UI panels on the GPU in dynamic batches. A batch is launched
+    when it is full or when YOLO_BATCH_TIMEOUT has passed since its first item.
+    Outside of debug mode only a copy of the UI panel is passed on to OCR,
+    so the full decoded screenshot is freed here.
+    """
+    try:
+        done = False
+        while not done:
+            item = load_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + YOLO_BATCH_TIMEOUT
+            while len(batch) < YOLO_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = load_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+
+            all_bounds = find_ui_panels([b[3] for b in batch], yolo_model)
+            for (path, video_id, timestamp, screenshot), ui_bounds in zip(batch, all_bounds):
+                roi_color = None
+                if not debug:
+                    # Debug windows are only opened from the OCR thread, which
+                    # crops the panel itself and keeps the full screenshot
+                    roi_color = crop_ui_panel(screenshot, ui_bounds, str(path))
+                    if roi_color is None:
+                        continue
+                    roi_color = roi_color.copy()
+                    screenshot = None
+                ocr_queue.put((path, video_id, timestamp, screenshot, ui_bounds, roi_color))
+    finally:
+        for _ in range(num_ocr_threads):
+            ocr_queue.put(None)
+
+def ocr_stage(ocr_queue, write_queue, debug):
+    """
+    Stage C: OCRs the UI panels on the CPU. Each thread has its own RapidOCR
+    engine and OCRs up to OCR_BATCH_SIZE panels per call, waiting at most
+    OCR_BATCH_TIMEOUT for a batch to fill up.
+    """
+    try:
+        reader = RapidOCR(params=OCR_ENGINE_PARAMS)
+        done = False
+        while not done:
+            item = ocr_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + OCR_BATCH_TIMEOUT
+            while len(batch) < OCR_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = ocr_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+
+            crops = []
+            for path, video_id, timestamp, screenshot, ui_bounds, roi_color in batch:
+                try:
+                    if roi_color is None:
+                        roi_color = crop_ui_panel(screenshot, ui_bounds, str(path), debug=debug)
+                    if roi_color is not None:
+                        crops.append((path, video_id, timestamp, screenshot, ui_bounds, roi_color))
+                except Exception as e:
+                    print(f"An error occurred on file {path}: {e}")
+            if not crops:
+                continue
+
+            batch_results = run_ocr_batch([c[5] for c in crops], reader)
+            for (path, video_id, timestamp, screenshot, ui_bounds, roi_color), ocr_results in zip(crops, batch_results):
+                try:
+                    results = read_gamertags(screenshot, ui_bounds, roi_color, ocr_results, str(path), debug=debug)
+                    if results:
+                        write_queue.put((video_id, timestamp, results))
+                except Exception as e:
+                    print(f"An error occurred on file {path}: {e}")
+    finally:
+        write_queue.put(None)
+
+def writer_stage(write_queue, num_ocr_threads):
+    """Stage D: the only thread that writes results (to the JSONL staging file)."""
+    finished = 0
+    saved = 0
+    with open(JSONL_STAGING_FILE, 'ab') as staging_file:
+        while finished < num_ocr_threads:
+            item = write_queue.get()
+            if item is None:
+                finished += 1
+                continue
+            try:
+                save_result(staging_file, *item)
+                saved += 1
+                if not VERBOSE and saved % PROGRESS_EVERY == 0:
+                    print(f"Saved gamertags for {saved} screenshots so far...")
+            except Exception as e:
+                print(f"CRITICAL: Failed to write to {JSONL_STAGING_FILE}: {e}")
 
 def initialize_json(filepath):
     """
     Initializes the JSON file with base data if it doesn't exist,
     and ensures all base entries have a 'screenshots' key.
+    Results staged by an interrupted run are merged in first.
     """
     data = {}
     if Path(filepath).exists():
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except json.JSONDecodeError:
+            with open(filepath, 'rb') as f:
+                data = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
             print(f"Warning: {filepath} was corrupt. Initializing from base data.")
             data = {}
     
-    # Write the (potentially) updated data back
+    # Write the (potentially) updated data back. An existing file with
+    # nothing staged is already up to date and is not rewritten.
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, sort_keys=True)
+        if not Path(filepath).exists() or Path(JSONL_STAGING_FILE).exists():
+            flush_staged_results(filepath, data)
     except Exception as e:
         print(f"FATAL: Could not initialize JSON file {filepath}: {e}")
         raise # Stop execution if we can't write to our output file
@@ -407,28 +877,46 @@ def main():
 
     # Find all screenshots
     try:
-        pathlist = Path(SCREENSHOTS_DIR).glob("**/*.png")
-        files = list(pathlist)
-        if not files:
-            print(f"No .png files found in {SCREENSHOTS_DIR} directory.")
+        # Only the screenshots still to process are kept in memory
+        pending, total = find_pending_screenshots(iter_screenshot_files(SCREENSHOTS_DIR), initialData)
+        if not total:
+            print(f"No screenshots found in {SCREENSHOTS_DIR} directory.")
             return
         
-        print(f"Found {len(files)} screenshots to process.")
+        print(f"Found {total} screenshots.")
+        if not pending:
+            print("All screenshots are already processed.")
+            return
+        print(f"{len(pending)} screenshots to process.")
+        
+        yolo_model = load_yolo_model()
+        if yolo_model is None:
+            print("Cannot proceed without YOLO.")
+            return
         
-        manager = mp.Manager()
-        lock = manager.Lock()
+        # Debug windows must not be opened from several threads at once
+        num_ocr_threads = 1 if DEBUG_MODE else NUM_THREADS
+        load_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        ocr_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        write_queue = queue.Queue()
         
-        # Use NUM_THREADS, but not more than the number of files
-        num_processes = min(NUM_THREADS, len(files))
-        if num_processes <= 0:
-             print("No files or threads to process.")
-             return
+        print(f"Starting pipeline with {num_ocr_threads} OCR thread(s)...")
+        threads = [
+            threading.Thread(target=loader_stage, args=(pending, load_queue)),
+            threading.Thread(target=yolo_stage, args=(yolo_model, load_queue, ocr_queue, num_ocr_threads, DEBUG_MODE)),
+            threading.Thread(target=writer_stage, args=(write_queue, num_ocr_threads)),
+        ]
+        threads += [
+            threading.Thread(target=ocr_stage, args=(ocr_queue, write_queue, DEBUG_MODE))
+            for _ in range(num_ocr_threads)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
         
-        initargs_tuple = (initialData, lock)
-        print(f"Starting processing pool with {num_processes} worker(s)...")
-        with mp.Pool(processes=num_processes, initializer=init_pool, initargs=initargs_tuple) as pool:
-            args_list = [(path, DEBUG_MODE) for path in files]
-            pool.starmap(process_file, args_list)
+        # Merge this run's staged results into the JSON once
+        flush_staged_results(JSON_OUTPUT_FILE, initialData)
             
         print("Processing complete.")
             
@@ -436,5 +924,4 @@ def main():
         print(f"A fatal error occurred: {e}")
 
 if __name__ == "__main__":
-    mp.freeze_support() # Good practice for multiprocessing
     main()
\ No newline at end of file
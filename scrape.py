@@ -1,61 +1,173 @@
 import yt_dlp
+import asyncio
 import subprocess
 import os
 import threading
-from yt_dlp.utils import DateRange
+import time
+from functools import lru_cache
+from collections import namedtuple
+from contextlib import nullcontext
+from yt_dlp.utils import DateRange, match_filter_func
 import curl_cffi
 from yt_dlp.networking import impersonate
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import math
 import datetime as dt
-import json
-import re
+# Much faster JSON parser/serializer for the video database
+# pip install orjson
+import orjson
+# Streaming JSON parser, for reading only the IDs of the video database
+# pip install ijson
+import ijson
 
 # --- CONFIGURATION ---
-# Max number of videos to download/process in parallel
-MAX_WORKERS = 30 
+# Max number of videos to screenshot in parallel (ffmpeg processes at once).
+# ffmpeg mostly waits on the network here (decode is on the GPU), so several
+# run per core, up to the old fixed cap of 30.
+FFMPEG_WORKERS = min(30, 4 * (os.cpu_count() or 4))
+# Channels fetched in parallel (yt-dlp listing and metadata requests). Each
+# channel thread reuses its YoutubeDL instances for every channel it fetches.
+CHANNEL_WORKERS = 4
+# Full metadata (stream URL) fetches run on this many threads, shared by all
+# channels, each with its own YoutubeDL. Together they start at most
+# METADATA_REQUESTS_PER_SEC fetches per second to stay clear of rate-limiting.
+METADATA_WORKERS = 3
+METADATA_REQUESTS_PER_SEC = 2
 # Time of the first screenshot in seconds
 START_TIME_SEC = 90  # 1:30
 # Interval between screenshots in seconds
 INTERVAL_SEC = 12 * 60 # 12 minutes
+# Grab the keyframe at or before each timestamp instead of decoding forward
+# to the exact second. A few seconds off doesn't matter for the scoreboard.
+FAST_SEEK = True
+# Screenshots are saved as high quality JPEGs (ffmpeg -q:v, 2 is best of 2-31).
+# They are far smaller and faster to encode than PNGs; PNGs from older runs
+# still count as existing screenshots.
+SCREENSHOT_EXT = ".jpg"
+JPEG_QUALITY = 2
+# When the GPU can JPEG-encode (mjpeg_vaapi), frames stay on the GPU and are
+# encoded there (quality 1-100) instead of on the CPU
+VAAPI_JPEG_QUALITY = 90
+VAAPI_DEVICE = "/dev/dri/renderD128"
+SCREENSHOT_EXTENSIONS = (".png", ".jpg")
+# Screenshots of a channel's videos are taken in batches of this many videos
+# while the metadata of the next batch is still being fetched. Each batch's
+# metadata is saved before its screenshots are taken.
+METADATA_BATCH_SIZE = 16
 # --- --- --- --- ---
 SCREENSHOT_DIR = "data/AllBarScreenshots"
 
 FETCH_FROM = "20240601"
 
 SCREENSHOT_DATA = "data/screenshot_data.json"
+# New and changed video metadata is appended here (one JSON object per line)
+# while running, then compacted into SCREENSHOT_DATA at the end of the run,
+# or earlier once the journal is bigger than the database file itself.
+# Only this script reads the journal: the other scripts only see journaled
+# videos once a run of scrape.py finishes (or is re-run after a crash).
+METADATA_JOURNAL = "data/screenshot_metadata.jsonl"
 DB_LOCK = threading.Lock()
-
-def populateHaveSet():
+# Parsed databases by file path, as ((database mtime, journal mtime), video_db).
+# The files are only parsed again if they changed on disk since they were
+# last loaded or written, and a database file changed by another script
+# during the run is merged in before it is overwritten.
+DB_CACHE = {}
+# The fields of a video's entry this script fetches; the other scripts add
+# their own (like the OCR "screenshots")
+METADATA_FIELDS = ('title', 'upload_date', 'duration', 'uploader', 'tags', 'thumbnail')
+# Start time of the next allowed metadata fetch (see wait_for_metadata_slot)
+METADATA_RATE_LOCK = threading.Lock()
+NEXT_METADATA_REQUEST = [0.0]
+
+# 'extract_flat': 'in_playlist' is the key.
+# It returns a list of video entries immediately.
+# Videos in the download archive (see populateHaveSet) are dropped from
+# the list here, so the full metadata is never fetched for them. The
+# archive only skips entries and never stops the listing, so older
+# videos without screenshots are still found. Live streams are skipped too.
+FLAT_FETCH_OPTS = {
+    'extract_flat': 'in_playlist',
+    'daterange': DateRange(start=FETCH_FROM),
+    'download_archive': '/tmp/haveScreenshots.txt',
+    'match_filter': match_filter_func('!is_live'),
+    'impersonate': impersonate.ImpersonateTarget("safari", "26.0"),
+    'extractor_args': {"youtube":{"player_client": ["tv_simply"]}},
+    'js_runtimes': {'node':{}},
+    'quiet': False,
+    'ignoreerrors': True,
+}
+# These are the options needed to get stream URLs
+FULL_FETCH_OPTS = {
+    'format': 'bestvideo*+bestaudio/best',
+    'impersonate': impersonate.ImpersonateTarget("safari", "26.0"),
+    'extractor_args': {"youtube":{"player_client": ["tv_simply"]}},
+    'js_runtimes': {'node':{}},
+    'quiet': False,
+}
+
+def populateHaveSet(video_db=None):
+    """
+    Writes the yt-dlp download archive of videos that already have screenshots
+    or are in the video database. Pass the already loaded video_db to avoid
+    reading SCREENSHOT_DATA a second time; otherwise only its IDs are read.
+    Returns the set of file names in SCREENSHOT_DIR, so screenshot existence
+    checks don't need a stat call per file.
+    """
     unique_ids = set()
+    existing_files = set()
 
     # 1. Process files in the Screenshot Directory
     if os.path.exists(SCREENSHOT_DIR) and os.path.isdir(SCREENSHOT_DIR):
-        for entry in os.listdir(SCREENSHOT_DIR):
-            full_path = os.path.join(SCREENSHOT_DIR, entry)
-            if os.path.isfile(full_path):
-                # Remove suffix to get the raw ID (e.g. "abc_30s.png" -> "abc")
-                video_id = re.sub(r"_\d+s\.png$", '', entry)
-                unique_ids.add(video_id.strip())
+        with os.scandir(SCREENSHOT_DIR) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    existing_files.add(entry.name)
+                    # Remove suffix to get the raw ID (e.g. "abc_30s.jpg" -> "abc").
+                    # Splitting at the last '_' keeps IDs that contain '_' whole,
+                    # and other names are kept as they are, like the old regex did.
+                    video_id, sep, tail = entry.name.rpartition('_')
+                    if not (sep and tail.endswith(('s.png', 's.jpg')) and tail[:-5].isdigit()):
+                        video_id = entry.name
+                    unique_ids.add(video_id.strip())
     
-    # 2. Process keys in the JSON Data file
-    if os.path.exists(SCREENSHOT_DATA) and os.path.isfile(SCREENSHOT_DATA):
-        try:
-            with open(SCREENSHOT_DATA, 'r') as f:
-                data = json.load(f)
-                # Iterate through keys to strip whitespace, ensuring " id " matches "id"
-                for video_id in data.keys():
-                    unique_ids.add(str(video_id).strip())
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Error reading {SCREENSHOT_DATA}: {e}")
-
-    # 3. Write sorted, unique IDs to file
+    # 2. Process keys in the JSON Data file and its journal
+    # Only the IDs are needed, so without a loaded database they are streamed
+    video_ids = video_db if video_db is not None else stream_video_ids(SCREENSHOT_DATA)
+    # Strip whitespace, ensuring " id " matches "id"
+    unique_ids.update(str(video_id).strip() for video_id in video_ids)
+
+    # 3. Write unique IDs to file
     with open("/tmp/haveScreenshots.txt", 'w') as f:
-        # sorted() makes the output deterministic and easier to read
-        for line in sorted(unique_ids):
-            f.write(f"youtube {line}\n")
+        # yt-dlp reads the archive into a set, so the IDs are not sorted.
+        # The whole archive is built as one string and written in one call.
+        if unique_ids:
+            f.write("youtube " + "\nyoutube ".join(unique_ids) + "\n")
+
+    return existing_files
+
+def stream_video_ids(db_filepath=SCREENSHOT_DATA, journal_filepath=METADATA_JOURNAL):
+    """
+    Yields the IDs of the videos in the database and its journal. The
+    database's top-level keys are streamed with ijson, so the metadata of
+    the videos is never built.
+    """
+    if os.path.isfile(db_filepath):
+        try:
+            with open(db_filepath, 'rb') as f:
+                for prefix, event, value in ijson.parse(f):
+                    if prefix == '' and event == 'map_key':
+                        yield value
+        except (ijson.JSONError, IOError) as e:
+            print(f"Error reading {db_filepath}: {e}")
+    if os.path.isfile(journal_filepath):
+        with open(journal_filepath, 'rb') as f:
+            for line in f:
+                try:
+                    video_id = orjson.loads(line).get('id')
+                except orjson.JSONDecodeError:
+                    continue  # A truncated line
+                if video_id:
+                    yield video_id
 
-populateHaveSet()
 def flatten_entries(entries):
     """Recursively flattens a list of entries (videos or playlists)."""
     if not entries:
@@ -70,39 +182,94 @@ def flatten_entries(entries):
         elif entry.get('id'):
             yield entry
 
-def update_video_database(video_list, db_filepath='screenshot_data.json'):
+def file_mtimes(*filepaths):
+    """Returns the mtime of every file, None for files that don't exist."""
+    mtimes = []
+    for filepath in filepaths:
+        try:
+            mtimes.append(os.path.getmtime(filepath))
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+def replay_video_journal(video_db, journal_filepath=METADATA_JOURNAL):
+    """
+    Applies every entry of the metadata journal to video_db, in order, so
+    the last entry of a video wins. Entries are merged into the existing
+    ones, keeping fields the journal doesn't have (like OCR "screenshots").
+    Returns how many entries were applied.
+    """
+    if not os.path.exists(journal_filepath):
+        return 0
+    count = 0
+    with open(journal_filepath, 'rb') as f:
+        for line in f:
+            try:
+                video_data = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                print(f"Warning: skipping a truncated line in {journal_filepath}.")
+                continue
+            video_id = video_data.pop('id', None)
+            if video_id:
+                video_db.setdefault(video_id, {}).update(video_data)
+                count += 1
+    return count
+
+def load_video_database(db_filepath=SCREENSHOT_DATA, journal_filepath=METADATA_JOURNAL):
+    """
+    Loads the JSON database of video metadata, with the entries of the
+    metadata journal applied on top.
+    The parsed database is kept in DB_CACHE, and the same dict is returned
+    again while neither file's mtime changed, so it is parsed once per run.
+    Returns the database dict (empty if it doesn't exist or can't be read).
+    """
+    mtimes = file_mtimes(db_filepath, journal_filepath)
+    cached = DB_CACHE.get(db_filepath)
+    if cached is not None and cached[0] == mtimes:
+        return cached[1]
+
+    video_db = {}
+    try:
+        with open(db_filepath, 'rb') as f:
+            video_db = orjson.loads(f.read())
+        # Ensure it's a dictionary
+        if not isinstance(video_db, dict):
+            print(f"Warning: '{db_filepath}' was not a valid dictionary. Starting fresh.")
+            video_db = {}
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        print(f"No existing database found at '{db_filepath}'. Creating a new one.")
+    except Exception as e:
+        print(f"Error reading database file: {e}. Starting with an empty DB.")
+
+    replayed = replay_video_journal(video_db, journal_filepath)
+    if replayed:
+        print(f"Applied {replayed} journaled entries from '{journal_filepath}'.")
+    DB_CACHE[db_filepath] = (mtimes, video_db)
+    return video_db
+
+def update_video_database(video_db, video_list, changed_ids=None):
     """
-    Loads, updates, and saves a JSON database of video metadata.
+    Updates the in-memory database of video metadata.
+    Call journal_video_database or save_video_database to write it to disk.
 
     Args:
+        video_db (dict): The database from load_video_database.
         video_list (list): A list of video dictionaries from yt-dlp.
-        db_filepath (str): Path to the JSON database file.
+        changed_ids (list): If given, the IDs of the added and updated
+            videos are appended to it.
 
     Returns:
-        tuple: A (additions_count, updates_count) tuple.
+        tuple: A (additions_count, updates_count) tuple. Videos whose
+        metadata didn't change are left alone and not counted, so (0, 0)
+        means the database doesn't need to be saved.
     """
-    video_db = {}
-    
-    # 1. Try to load the existing database
-    with DB_LOCK:
-        try:
-            with open(db_filepath, 'r', encoding='utf-8') as f:
-                video_db = json.load(f)
-            # Ensure it's a dictionary
-            if not isinstance(video_db, dict):
-                print(f"Warning: '{db_filepath}' was not a valid dictionary. Starting fresh.")
-                video_db = {}
-        except (FileNotFoundError, json.JSONDecodeError):
-            print(f"No existing database found at '{db_filepath}'. Creating a new one.")
-            video_db = {}
-        except Exception as e:
-            print(f"Error reading database file: {e}. Starting with an empty DB.")
-            video_db = {}
-
-        updates_count = 0
-        additions_count = 0
+    updates_count = 0
+    additions_count = 0
+    if not video_list:
+        return (additions_count, updates_count)
 
-        # 2. Iterate through fetched videos and update the db
+    with DB_LOCK:
+        # Iterate through fetched videos and update the db
         for video in video_list:
             if not video or not video.get('id'):
                 continue  # Skip invalid entries
@@ -110,155 +277,458 @@ def update_video_database(video_list, db_filepath='screenshot_data.json'):
             video_id = video.get('id')
 
             # Create the data payload with requested fields
-            video_data = {
-                'title': video.get('title'),
-                'upload_date': video.get('upload_date'), # 'creation data'
-                'duration': video.get('duration'),
-                'uploader': video.get('uploader'),
-                'tags': video.get('tags'),
-                'thumbnail': video.get('thumbnail')
-            }
+            video_data = {key: video.get(key) for key in METADATA_FIELDS}
 
             # Check if it's an addition or update
-            if video_id in video_db:
+            existing = video_db.get(video_id)
+            if existing is not None:
+                if all(existing.get(key) == value for key, value in video_data.items()):
+                    continue  # Unchanged
                 updates_count += 1
             else:
                 additions_count += 1
             
             # Add or update the entry
             video_db[video_id] = video_data
+            if changed_ids is not None:
+                changed_ids.append(video_id)
 
-        # 3. Write the updated database back to the file
-        try:
-            with open(db_filepath, 'w', encoding='utf-8') as f:
-                # Use indent=4 for readability, ensure_ascii=False for special chars
-                json.dump(video_db, f, indent=4, ensure_ascii=False)
-        except IOError as e:
-            print(f"\n[ERROR] Could not write database to '{db_filepath}': {e}")
-            # Return 0,0 if save fails
-            return (0, 0)
-        
-        # 4. Return the result
-        return (additions_count, updates_count)
+    return (additions_count, updates_count)
 
-def process_video_screenshots(video, output_dir, game_tag=""):
+def merge_changed_database(video_db, db_filepath=SCREENSHOT_DATA):
     """
-    Processes a single video entry:
-    - Filters by tag
-    - Checks if all screenshots *already exist* before processing.
-    - Takes screenshots at START_TIME_SEC and every INTERVAL_SEC thereafter.
-    - This function is designed to be run in a thread pool.
+    If db_filepath changed on disk since video_db was loaded (e.g.
+    processScreenshotsRapidOCR.py saved OCR results meanwhile), merges the
+    file into video_db so saving doesn't undo those changes: the file's
+    entries are kept, with their METADATA_FIELDS taken from video_db.
+    Call with DB_LOCK held.
+    """
+    cached = DB_CACHE.get(db_filepath)
+    if cached is None or cached[0][0] == file_mtimes(db_filepath)[0]:
+        return
+    try:
+        with open(db_filepath, 'rb') as f:
+            on_disk = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError) as e:
+        print(f"Warning: '{db_filepath}' changed during the run but could not be read ({e}).")
+        return
+    if not isinstance(on_disk, dict):
+        return
+    print(f"'{db_filepath}' changed during the run, merging it in before saving.")
+    for video_id, entry in on_disk.items():
+        ours = video_db.get(video_id)
+        if ours is not None:
+            entry.update((key, ours[key]) for key in METADATA_FIELDS if key in ours)
+        video_db[video_id] = entry
+
+def save_video_database(video_db, db_filepath=SCREENSHOT_DATA, journal_filepath=METADATA_JOURNAL):
+    """
+    Writes the whole database to disk atomically: it is written to a temp
+    file first, which then replaces db_filepath. The metadata journal is
+    then deleted, as all of its entries are in video_db.
+    Changes another script made to db_filepath since it was loaded are
+    merged in first (see merge_changed_database).
+    DB_CACHE is updated to the new mtime, so the next load_video_database
+    doesn't parse it again.
+    Returns True on success.
+    """
+    tmp_filepath = db_filepath + '.tmp'
+    try:
+        # Channels are fetched in parallel; only one thread writes at a time
+        with DB_LOCK:
+            merge_changed_database(video_db, db_filepath)
+            with open(tmp_filepath, 'wb') as f:
+                f.write(orjson.dumps(video_db, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_filepath, db_filepath)
+            if os.path.exists(journal_filepath):
+                os.remove(journal_filepath)
+            DB_CACHE[db_filepath] = (file_mtimes(db_filepath, journal_filepath), video_db)
+        return True
+    except IOError as e:
+        print(f"\n[ERROR] Could not write database to '{db_filepath}': {e}")
+        return False
+
+def journal_video_database(video_db, video_ids, db_filepath=SCREENSHOT_DATA, journal_filepath=METADATA_JOURNAL):
+    """
+    Appends the entries of video_ids to the metadata journal, instead of
+    rewriting the whole database for a few changed videos. Once the journal
+    is bigger than db_filepath, it is compacted with save_video_database.
+    Returns True on success.
+    """
+    lines = b"".join(
+        orjson.dumps({'id': video_id, **video_db[video_id]}) + b"\n"
+        for video_id in video_ids
+    )
+    try:
+        with DB_LOCK:
+            with open(journal_filepath, 'ab') as f:
+                f.write(lines)
+            # Keep the database mtime it was loaded at, so a change another
+            # script makes to it is still noticed
+            cached = DB_CACHE.get(db_filepath)
+            db_mtime = cached[0][0] if cached else file_mtimes(db_filepath)[0]
+            DB_CACHE[db_filepath] = ((db_mtime, *file_mtimes(journal_filepath)), video_db)
+            # Sized under the lock, as another thread's compaction deletes the journal
+            journal_size = os.path.getsize(journal_filepath)
+    except IOError as e:
+        print(f"\n[ERROR] Could not append to the journal '{journal_filepath}': {e}")
+        return False
+
+    try:
+        database_size = os.path.getsize(db_filepath)
+    except OSError:
+        database_size = 0
+    if journal_size > database_size:
+        return save_video_database(video_db, db_filepath, journal_filepath)
+    return True
+
+@lru_cache(maxsize=None)
+def vaapi_jpeg_encoder_available():
+    """
+    Checks once per run if the GPU can JPEG-encode with mjpeg_vaapi, by
+    encoding a one-frame test image. ffmpeg listing the encoder only means it
+    was built with it; the driver may still not support JPEG encoding.
+    """
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+             '-init_hw_device', f'vaapi=va:{VAAPI_DEVICE}', '-filter_hw_device', 'va',
+             '-f', 'lavfi', '-i', 'color=black:size=64x64',
+             '-vf', 'format=nv12,hwupload', '-frames:v', '1',
+             '-c:v', 'mjpeg_vaapi', '-f', 'null', '-'],
+            capture_output=True
+        )
+    except FileNotFoundError:
+        return False
+    return result.returncode == 0
+
+def build_ffmpeg_command(stream_url, header_string, timestamps, output_filenames, gpu_encode):
+    """
+    Builds one ffmpeg command that grabs a frame at each timestamp into its
+    output file. Every timestamp is its own input, seeked to with -ss before
+    -i so only the data around it is fetched, and is mapped to its own
+    one-frame output. (A select='eq(t,..)' filter on one input would have to
+    download and decode the whole video up to the last timestamp.)
+    """
+    # The input options are the same for every timestamp, so build them once
+    input_options = []
+    if header_string:
+        input_options.extend(['-headers', header_string])
+
+    input_options.extend([
+        '-hwaccel', 'vaapi',                 # 1. Force VAAPI
+        '-hwaccel_device', VAAPI_DEVICE,     # 2. Select the AMD GPU
+        # 3. Keep the frame on the GPU for the encoder, or copy it to the CPU
+        '-hwaccel_output_format', 'vaapi' if gpu_encode else 'yuv420p',
+        '-reconnect', '1',
+        # One decode thread per input: only a frame is decoded, and up to
+        # FFMPEG_WORKERS ffmpegs run at once, so more threads only contend
+        '-threads', '1',
+    ])
+    if FAST_SEEK:
+        input_options.append('-noaccurate_seek')
+
+    # Output goes to DEVNULL anyway, so skip formatting ffmpeg's logs
+    ffmpeg_command = ['ffmpeg', '-y', '-nostdin', '-loglevel', 'error']
+    if gpu_encode:
+        # The device the encoder's filter uploads frames to
+        ffmpeg_command.extend(['-init_hw_device', f'vaapi=va:{VAAPI_DEVICE}', '-filter_hw_device', 'va'])
+    for timestamp_sec in timestamps:
+        ffmpeg_command.extend(input_options)
+        ffmpeg_command.extend([
+            '-ss', str(timestamp_sec), 
+            '-i', stream_url,
+        ])
+    for input_index, output_filename in enumerate(output_filenames):
+        ffmpeg_command.extend(['-map', f'{input_index}:v:0', '-vframes', '1'])
+        if gpu_encode:
+            # Codecs the GPU can't decode fall back to software decoding, so
+            # upload those frames; frames already on the GPU pass through
+            ffmpeg_command.extend(['-vf', 'format=nv12|vaapi,hwupload'])
+            ffmpeg_command.extend(['-c:v', 'mjpeg_vaapi', '-global_quality', str(VAAPI_JPEG_QUALITY)])
+        else:
+            ffmpeg_command.extend(['-q:v', str(JPEG_QUALITY)])
+        ffmpeg_command.append(output_filename)
+    return ffmpeg_command
+
+async def run_ffmpeg(ffmpeg_command):
+    """Runs an ffmpeg command without its output and returns its exit code."""
+    proc = await asyncio.create_subprocess_exec(
+        *ffmpeg_command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    return await proc.wait()
+
+def has_screenshot(output_dir, video_id, timestamp_sec, existing_files=None):
+    """
+    Checks if a screenshot exists in any of SCREENSHOT_EXTENSIONS, in
+    existing_files (the file names in output_dir) when given, else on disk.
+    """
+    for ext in SCREENSHOT_EXTENSIONS:
+        filename = f"{video_id}_{timestamp_sec}s{ext}"
+        if existing_files is None:
+            if os.path.exists(os.path.join(output_dir, filename)):
+                return True
+        elif filename in existing_files:
+            return True
+    return False
+
+@lru_cache(maxsize=4096)
+def lower_tag(tag):
+    """Lowercases a video tag. Channels reuse the same tags on most of their videos."""
+    return tag.lower()
+
+def check_video_screenshots(video, output_dir, game_tag_lower="", existing_files=None):
+    """
+    The cheap checks done before a video is processed:
+    - Filters by tag (game_tag_lower must already be lowercased)
+    - Checks if all screenshots *already exist* before processing
+      (against existing_files, the file names in output_dir, when given).
+    Returns (skip_result, missing_timestamps). skip_result is the
+    (video_id, message, 0) result if the video needs no processing, else None.
     """
     if video is None:
-        return None, "Skipped (None entry)", 0
+        return (None, "Skipped (None entry)", 0), []
 
     video_id = video.get('id')
     video_title = video.get('title', 'N/A')
     tags = video.get('tags')
 
     # --- PYTHON TAG FILTER ---
-    if game_tag: # Only filter if a game_tag is provided
+    if game_tag_lower: # Only filter if a game_tag is provided
         if not isinstance(tags, list):
-            return video_id, f"Skipped '{video_title}' (No tags)", 0
+            return (video_id, f"Skipped '{video_title}' (No tags)", 0), []
         
-        if game_tag.lower() not in [tag.lower() for tag in tags]:
-            return video_id, f"Skipped '{video_title}' (Tag not found)", 0
+        if game_tag_lower not in map(lower_tag, tags):
+            return (video_id, f"Skipped '{video_title}' (Tag not found)", 0), []
 
     # --- DURATION & COMPLETION CHECK ---
     duration = video.get('duration')
     if not duration:
-        return video_id, f"Skipped '{video_title}' (No duration info)", 0
+        return (video_id, f"Skipped '{video_title}' (No duration info)", 0), []
         
     if duration < START_TIME_SEC:
-        return video_id, f"Skipped '{video_title}' (Shorter than {START_TIME_SEC}s)", 0
+        return (video_id, f"Skipped '{video_title}' (Shorter than {START_TIME_SEC}s)", 0), []
 
     # --- "ALL-OR-NOTHING" CHECK ---
-    expected_timestamps = list(range(START_TIME_SEC, math.floor(duration), INTERVAL_SEC))
-    
-    all_files_exist = True
-    if not expected_timestamps:
-        pass
+    # duration is positive here, so int() floors it
+    expected_timestamps = range(START_TIME_SEC, int(duration), INTERVAL_SEC)
     
-    for timestamp_sec in expected_timestamps:
-        output_filename = os.path.join(output_dir, f"{video_id}_{timestamp_sec}s.png")
-        if not os.path.exists(output_filename):
-            all_files_exist = False
-            break
+    missing_timestamps = [
+        timestamp_sec for timestamp_sec in expected_timestamps
+        if not has_screenshot(output_dir, video_id, timestamp_sec, existing_files)
+    ]
     
-    if all_files_exist:
-        return video_id, f"Skipped '{video_title}' (All screenshots exist)", 0
+    if not missing_timestamps:
+        return (video_id, f"Skipped '{video_title}' (All screenshots exist)", 0), []
     # --- END NEW CHECK ---
+    return None, missing_timestamps
 
+async def process_video_screenshots(video, output_dir, game_tag_lower="", existing_files=None,
+                                    missing_timestamps=None):
+    """
+    Processes a single video entry:
+    - Runs check_video_screenshots, unless its missing_timestamps are given.
+    - Takes the missing screenshots at START_TIME_SEC and every INTERVAL_SEC thereafter.
+    - This coroutine is designed to be run concurrently by process_videos.
+    """
+    if missing_timestamps is None:
+        skip_result, missing_timestamps = check_video_screenshots(video, output_dir, game_tag_lower, existing_files)
+        if skip_result:
+            return skip_result
+
+    video_id = video.get('id')
+    video_title = video.get('title', 'N/A')
 
     # --- PROCESS VIDEO (BECAUSE FILES ARE MISSING) ---
     
-    try:
-        stream_url = video['requested_formats'][0]['url']
-        http_headers = video['requested_formats'][0]['http_headers']
-    except:
-        stream_url = video.get('url')
-        http_headers = video.get('http_headers')
+    # The stream of the first requested format (the video one), or the
+    # video's own when yt-dlp picked a single format
+    stream_format = (video.get('requested_formats') or [None])[0] or {}
+    if 'url' not in stream_format or 'http_headers' not in stream_format:
+        stream_format = video
+    stream_url = stream_format.get('url')
+    http_headers = stream_format.get('http_headers')
     if not stream_url:
         return video_id, f"Skipped '{video_title}' (Could not get stream URL)", 0
     else:
         print(f"Format: {video.get('format_note')} (ID: {video_id})")
+    # Built once per video; every timestamp input reuses it via input_options.
+    # ffmpeg expects each header line to end in CRLF.
     header_string = ""
     if http_headers:
-        header_string = "".join(
-            f"{key}: {value}\r\n" for key, value in http_headers.items()
-        )
+        header_string = "\r\n".join(
+            f"{key}: {value}" for key, value in http_headers.items()
+        ) + "\r\n"
 
+    output_filenames = [
+        os.path.join(output_dir, f"{video_id}_{timestamp_sec}s{SCREENSHOT_EXT}")
+        for timestamp_sec in missing_timestamps
+    ]
+
+    # 6. Use a single ffmpeg process to grab all missing screenshots.
+    # Without the GPU JPEG encoder, frames are copied to the CPU and encoded there
+    gpu_encode = vaapi_jpeg_encoder_available()
+    try:
+        returncode = await run_ffmpeg(build_ffmpeg_command(
+            stream_url, header_string, missing_timestamps, output_filenames, gpu_encode
+        ))
+        if returncode != 0 and gpu_encode:
+            # Retry whatever the GPU encode didn't write on the CPU
+            retry = [
+                (timestamp_sec, output_filename)
+                for timestamp_sec, output_filename in zip(missing_timestamps, output_filenames)
+                if not os.path.exists(output_filename)
+            ]
+            if retry:
+                print(f"GPU encode failed for '{video_title}' (exit code {returncode}), retrying on the CPU")
+                retry_timestamps, retry_filenames = zip(*retry)
+                returncode = await run_ffmpeg(build_ffmpeg_command(
+                    stream_url, header_string, retry_timestamps, retry_filenames, False
+                ))
+        if returncode != 0:
+            # Print the error code for easier debugging
+            print(f"--- FAILED (ffmpeg) for '{video_title}' at {missing_timestamps}s. Exit code: {returncode}")
+    except FileNotFoundError:
+        print("\n[ERROR] 'ffmpeg' command not found.")
+        return video_id, "Failed (ffmpeg not found)", 0
     screenshots_taken = 0
-    
-    for timestamp_sec in expected_timestamps:
-        
-        output_filename = os.path.join(output_dir, f"{video_id}_{timestamp_sec}s.png")
-        
+    for output_filename in output_filenames:
         if os.path.exists(output_filename):
-            continue
+            screenshots_taken += 1
+            if existing_files is not None:
+                existing_files.add(os.path.basename(output_filename))
+    return video_id, f"Processed '{video_title}, format: {video.get("format")}'", screenshots_taken
+
+
+def start_screenshot_loop():
+    """
+    Starts the event loop that takes the screenshots of every channel, in a
+    background thread, so channels can be fetched in parallel while sharing
+    one cap of FFMPEG_WORKERS ffmpeg processes.
+    Returns the loop and the semaphore to pass to get_channel_screenshots.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop, asyncio.Semaphore(FFMPEG_WORKERS)
+
+async def process_videos(videos, output_dir, game_tag="", existing_files=None, semaphore=None):
+    """
+    Takes the screenshots of all videos concurrently on one event loop,
+    with at most FFMPEG_WORKERS videos (ffmpeg processes) in progress at once.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(FFMPEG_WORKERS)
+    # The tag is the same for every video, so lowercase it once
+    game_tag_lower = game_tag.lower()
 
-        # 6. Use ffmpeg to grab the screenshot
-        ffmpeg_command = ['ffmpeg']
+    async def process_one(video_info, missing_timestamps):
+        async with semaphore:
+            try:
+                return await process_video_screenshots(
+                    video_info, output_dir, game_tag_lower, existing_files, missing_timestamps
+                )
+            except Exception as e:
+                print(f"[ERROR] Task for video ID {video_info.get('id', 'unknown')} failed: {e}")
+                return None
+
+    # Run the cheap checks first so only videos that need ffmpeg become tasks
+    tasks = []
+    skipped = 0
+    for video_info in videos:
+        skip_result, missing_timestamps = check_video_screenshots(
+            video_info, output_dir, game_tag_lower, existing_files
+        )
+        if skip_result:
+            skipped += 1
+            continue
+        tasks.append(process_one(video_info, missing_timestamps))
+    if skipped:
+        print(f"--- INFO: Skipped {skipped} videos (filtered out or all screenshots exist).")
+    print(f"Submitted {len(tasks)} videos to {FFMPEG_WORKERS} workers.")
+
+    for next_result in asyncio.as_completed(tasks):
+        # This will be (vid_id, message, count)
+        result = await next_result
+        if not result:
+            continue
+            
+        vid_id, message, count = result
         
-        if header_string:
-            ffmpeg_command.extend(['-headers', header_string])
+        if count > 0:
+            print(f"+++ SUCCESS (ID: {vid_id}): Grabbed {count} new screenshot(s) from '{message.replace('Processed ', '')}'")
+        elif "Skipped" in message:
+            print(f"--- INFO (ID: {vid_id}): {message}")
 
-        ffmpeg_command.extend([
-            '-hwaccel', 'vaapi',                 # 1. Force VAAPI
-            '-hwaccel_device', '/dev/dri/renderD128', # 2. Select the AMD GPU
-            '-hwaccel_output_format', 'yuv420p', # 3. Copy frame from GPU to CPU
-            '-ss', str(timestamp_sec), 
-            '-i', stream_url,
-            '-vframes', '1',
-            '-reconnect', '1',
-            '-y',
-            output_filename
-        ])
-        try:
-            subprocess.run(
-                ffmpeg_command,
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            screenshots_taken += 1
-        except subprocess.CalledProcessError as e:
-            # Print the error code for easier debugging
-            print(f"--- FAILED (ffmpeg) for '{video_title}' at {timestamp_sec}s. Error: {e}")
-        except FileNotFoundError:
-            print("\n[ERROR] 'ffmpeg' command not found.")
-            return video_id, "Failed (ffmpeg not found)", screenshots_taken
-    return video_id, f"Processed '{video_title}, format: {video.get("format")}'", screenshots_taken
+def thread_youtube_dl(thread_state, instances, opts):
+    """
+    Returns this thread's YoutubeDL instance made with opts, creating it on
+    first use and adding it to instances so it can be closed. One instance
+    isn't thread-safe, so each thread keeps its own and reuses it for every
+    request. Use a separate thread_state for each opts.
+    """
+    ydl = getattr(thread_state, 'ydl', None)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(opts)
+        thread_state.ydl = ydl
+        instances.append(ydl)
+    return ydl
+
+# The threads fetching full video metadata (see start_metadata_pool)
+MetadataPool = namedtuple('MetadataPool', ['executor', 'thread_state', 'instances'])
 
+def start_metadata_pool(instances):
+    """
+    Starts the METADATA_WORKERS threads that fetch full video metadata.
+    Their YoutubeDL instances are added to instances, for the caller to close
+    after shutting the pool's executor down.
+    Returns the MetadataPool to pass to get_channel_screenshots.
+    """
+    return MetadataPool(ThreadPoolExecutor(max_workers=METADATA_WORKERS), threading.local(), instances)
 
-def get_channel_screenshots(channel_url, output_dir, game_tag=""):
+def wait_for_metadata_slot():
+    """
+    Blocks until the next full metadata fetch may start, so the fetches of
+    all threads start at least 1 / METADATA_REQUESTS_PER_SEC seconds apart.
+    """
+    with METADATA_RATE_LOCK:
+        delay = NEXT_METADATA_REQUEST[0] - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        NEXT_METADATA_REQUEST[0] = time.monotonic() + 1 / METADATA_REQUESTS_PER_SEC
+
+def fetch_full_video_info(video_url, metadata_pool):
+    """Fetches the full metadata of a video on a thread of metadata_pool."""
+    ydl = thread_youtube_dl(metadata_pool.thread_state, metadata_pool.instances, FULL_FETCH_OPTS)
+    wait_for_metadata_slot()
+    return ydl.extract_info(video_url, download=False)
+
+def get_channel_screenshots(channel_url, output_dir, game_tag="", existing_files=None, video_db=None,
+                            screenshot_loop=None, semaphore=None, flat_ydl=None, metadata_pool=None):
     """
     Downloads screenshots from all videos in a channel using a 
     two-stage, library-only method to avoid rate-limiting.
+    The metadata of the fetched videos is added to video_db in batches of
+    METADATA_BATCH_SIZE videos. Each batch is journaled and then handed to
+    screenshot_loop (from start_screenshot_loop, else an event loop of this
+    call's own), so its screenshots are taken while the next batch's
+    metadata is fetched.
+    flat_ydl is a YoutubeDL instance made with FLAT_FETCH_OPTS to reuse across
+    channels, and metadata_pool (from start_metadata_pool) the threads that
+    fetch the full metadata; new ones are made if not given.
+    existing_files is the set of file names in output_dir (see populateHaveSet);
+    if not given, output_dir is scanned once here.
     """
+    if video_db is None:
+        video_db = load_video_database(SCREENSHOT_DATA)
     
     os.makedirs(output_dir, exist_ok=True)
     print(f"Saving screenshots to: {os.path.abspath(output_dir)}")
+    if existing_files is None:
+        # One directory scan instead of a stat call per expected screenshot
+        with os.scandir(output_dir) as entries:
+            existing_files = {entry.name for entry in entries if entry.is_file()}
 
     # --- STAGE 1: Fast "flat" fetch ---
     # We fetch *only* the playlist structure, not the
@@ -267,21 +737,8 @@ def get_channel_screenshots(channel_url, output_dir, game_tag=""):
     
     print(f"Stage 1: Fetching flat video list for channel: {channel_url}...")
     
-    # 'extract_flat': 'in_playlist' is the key.
-    # It returns a list of video entries immediately.
-    flat_opts = {
-        'extract_flat': 'in_playlist',
-        'daterange': DateRange(start=FETCH_FROM),
-        'download_archive': '/tmp/haveScreenshots.txt',
-        'impersonate': impersonate.ImpersonateTarget("safari", "26.0"),
-        'extractor_args': {"youtube":{"player_client": ["tv_simply"]}},
-        'js_runtimes': {'node':{}},
-        'quiet': False,
-        'ignoreerrors': True,
-    }
-
     try:
-        with yt_dlp.YoutubeDL(flat_opts) as ydl:
+        with nullcontext(flat_ydl) if flat_ydl else yt_dlp.YoutubeDL(FLAT_FETCH_OPTS) as ydl:
             # This call is now very fast and returns a flat list
             # of all videos that passed the daterange/archive filters.
             channel_info = ydl.extract_info(channel_url, download=False)
@@ -297,8 +754,18 @@ def get_channel_screenshots(channel_url, output_dir, game_tag=""):
         print("No new videos found matching your criteria.")
         return True
 
-    # The videos are already flat, so we just grab the list
-    videos_to_process = channel_info['entries']
+    # The videos are already flat, so we just grab the list.
+    # Skip videos whose screenshots are all on disk already (e.g. when the
+    # archive is out of date), so their full metadata isn't fetched
+    videos_to_process = []
+    for video_stub in flatten_entries(channel_info['entries']):
+        duration = video_stub.get('duration')
+        if duration and all(
+            has_screenshot(output_dir, video_stub['id'], timestamp_sec, existing_files)
+            for timestamp_sec in range(START_TIME_SEC, int(duration), INTERVAL_SEC)
+        ):
+            continue
+        videos_to_process.append(video_stub)
     
     # We didn't use 'break_on_reject', so we have all videos
     # since FETCH_FROM. We can't stop early, but this single
@@ -309,92 +776,83 @@ def get_channel_screenshots(channel_url, output_dir, game_tag=""):
     # Now we loop through our filtered list and fetch the *full*
     # metadata (with stream URLs) only for these few videos.
     
-    print("Stage 2: Submitting videos to processing pool...")
-    
-    # These are the options needed to get stream URLs
-    full_fetch_opts = {
-        'format': 'bestvideo*+bestaudio/best',
-        'impersonate': impersonate.ImpersonateTarget("safari", "26.0"),
-        'extractor_args': {"youtube":{"player_client": ["tv_simply"]}},
-        'js_runtimes': {'node':{}},
-        'quiet': False,
-    }
-    print("Stage 2: Fetching full metadata for new videos sequentially...")
-    full_videos_to_process = []
-    
-    # Use a single ydl instance to fetch metadata sequentially
-    try:
-        with yt_dlp.YoutubeDL(full_fetch_opts) as ydl:
-            for i, video_stub in enumerate(videos_to_process, 1):
-                if not video_stub or not video_stub.get('url'):
-                    print(f"[WARN] Skipping video stub {i}/{len(videos_to_process)} (no URL).")
-                    continue
-                
-                print(f"Fetching metadata for video {i}/{len(videos_to_process)}: {video_stub.get('id')}")
-                try:
-                    # 1. FETCH SEQUENTIALLY
-                    full_video_info = ydl.extract_info(video_stub['url'], download=False)
-                    
-                    if not full_video_info:
-                        print(f"[WARN] Failed to fetch full info for {video_stub.get('id')}.")
-                        continue
-                        
-                    # 2. UPDATE DATABASE SEQUENTIALLY
-                    update_video_database([full_video_info], SCREENSHOT_DATA)
-                    
-                    # 3. ADD TO LIST FOR PARALLEL PROCESSING
-                    full_videos_to_process.append(full_video_info)
-                    
-                except yt_dlp.utils.DownloadError as e:
-                    print(f"[WARN] Failed to fetch {video_stub.get('id')}: {e}. Video may be private/deleted.")
-                except Exception as e:
-                    print(f"[ERROR] Unexpected error fetching {video_stub.get('id')}: {e}")
-
-    except Exception as e:
-        print(f"[ERROR] Failed to initialize YoutubeDL for Stage 2: {e}")
-        return False
+    print(f"Stage 2: Fetching full metadata for new videos on {METADATA_WORKERS} threads...")
+    print(f"Stage 2: Submitting screenshots every {METADATA_BATCH_SIZE} videos to the event loop...")
+    own_loop = screenshot_loop is None
+    if own_loop:
+        screenshot_loop, semaphore = start_screenshot_loop()
+    own_pool = metadata_pool is None
+    if own_pool:
+        metadata_pool = start_metadata_pool([])
+    screenshot_batches = []
+    batch = []
+    processable_count = 0
+
+    def submit_batch():
+        # Save the metadata before taking screenshots: videos with screenshots
+        # are skipped by later runs, so their metadata must already be on disk
+        changed_ids = []
+        update_video_database(video_db, batch, changed_ids)
+        if changed_ids:
+            journal_video_database(video_db, changed_ids, SCREENSHOT_DATA)
+        screenshots = process_videos(list(batch), output_dir, game_tag, existing_files, semaphore)
+        screenshot_batches.append(asyncio.run_coroutine_threadsafe(screenshots, screenshot_loop))
+        batch.clear()
 
-    print(f"\nMetadata fetch complete. Found {len(full_videos_to_process)} processable videos.")
-    print("Submitting screenshot processing to parallel thread pool...")
-
-    # Now, process the screenshots in parallel using the full info we just gathered
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_video_id = {}
-        
-        for video_info in full_videos_to_process:
-            future = executor.submit(
-                process_video_screenshots, 
-                video_info, 
-                output_dir, 
-                game_tag
-            )
-            future_to_video_id[future] = video_info.get('id', 'unknown')
-
-        print(f"Submitted {len(future_to_video_id)} videos to {MAX_WORKERS} workers.")
-        
-        for future in as_completed(future_to_video_id):
-            video_id_from_future = future_to_video_id[future]
+    try:
+        # Submit every fetch, then handle the results as they come in
+        fetches = {}
+        for i, video_stub in enumerate(videos_to_process, 1):
+            if not video_stub or not video_stub.get('url'):
+                print(f"[WARN] Skipping video stub {i}/{len(videos_to_process)} (no URL).")
+                continue
+            fetch = metadata_pool.executor.submit(fetch_full_video_info, video_stub['url'], metadata_pool)
+            fetches[fetch] = video_stub
+
+        for i, fetch in enumerate(as_completed(fetches), 1):
+            video_stub = fetches[fetch]
+            print(f"Fetched metadata for video {i}/{len(fetches)}: {video_stub.get('id')}")
             try:
-                # This will be (vid_id, message, count)
-                result = future.result()
-                if not result:
+                # 1. FETCHED IN PARALLEL, RATE-LIMITED
+                full_video_info = fetch.result()
+                
+                if not full_video_info:
+                    print(f"[WARN] Failed to fetch full info for {video_stub.get('id')}.")
                     continue
                     
-                vid_id, message, count = result
+                # 2. ADD TO THE BATCH FOR THE DATABASE AND PARALLEL PROCESSING
+                batch.append(full_video_info)
+                processable_count += 1
+                if len(batch) >= METADATA_BATCH_SIZE:
+                    submit_batch()
                 
-                if count > 0:
-                    print(f"+++ SUCCESS (ID: {vid_id}): Grabbed {count} new screenshot(s) from '{message.replace('Processed ', '')}'")
-                elif "Skipped" in message:
-                    print(f"--- INFO (ID: {vid_id}): {message}")
-                    pass 
-                    
+            except yt_dlp.utils.DownloadError as e:
+                print(f"[WARN] Failed to fetch {video_stub.get('id')}: {e}. Video may be private/deleted.")
             except Exception as e:
-                print(f"[ERROR] Thread for video ID {video_id_from_future} failed: {e}")
+                print(f"[ERROR] Unexpected error fetching {video_stub.get('id')}: {e}")
+
+        if batch:
+            submit_batch()
+        print(f"\nMetadata fetch complete. Found {processable_count} processable videos.")
+
+        # Wait for the screenshots of every batch of this channel
+        for screenshot_batch in screenshot_batches:
+            screenshot_batch.result()
+    finally:
+        if own_loop:
+            screenshot_loop.call_soon_threadsafe(screenshot_loop.stop)
+        if own_pool:
+            metadata_pool.executor.shutdown()
+            for ydl in metadata_pool.instances:
+                ydl.close()
     return True
 # --- --- --- --- ---
 #      RUN SCRIPT
 # --- --- --- --- ---
 if __name__ == "__main__":
+    # The database is parsed once and its IDs also go into the download archive
+    video_db = load_video_database(SCREENSHOT_DATA)
+    existing_files = populateHaveSet(video_db)
     channels = [
         "https://www.youtube.com/channel/UC-QkFO7qGgPv5J3c8pGOpIQ/recent",
         "https://www.youtube.com/@BetterStrategy/videos",
@@ -405,10 +863,36 @@ if __name__ == "__main__":
         "https://www.youtube.com/@MoreDrongo/videos",
         "https://www.youtube.com/@SuperKitowiec2/videos",
     ]
-    for channel in channels:
-        get_channel_screenshots(
+    # Fetch the channels in parallel; their screenshots share one event loop
+    screenshot_loop, semaphore = start_screenshot_loop()
+    # Full metadata is fetched on one pool shared by all channels
+    thread_state = threading.local()
+    instances = []
+    metadata_pool = start_metadata_pool(instances)
+
+    def fetch_channel(channel):
+        flat_ydl = thread_youtube_dl(thread_state, instances, FLAT_FETCH_OPTS)
+        return get_channel_screenshots(
             channel_url=channel, 
             output_dir=SCREENSHOT_DIR,
-            game_tag=""  
+            game_tag="",
+            existing_files=existing_files,
+            video_db=video_db,
+            screenshot_loop=screenshot_loop,
+            semaphore=semaphore,
+            flat_ydl=flat_ydl,
+            metadata_pool=metadata_pool
         )
+
+    try:
+        with ThreadPoolExecutor(max_workers=CHANNEL_WORKERS) as executor:
+            list(executor.map(fetch_channel, channels))
+    finally:
+        metadata_pool.executor.shutdown()
+        for ydl in instances:
+            ydl.close()
+        # Compact the journal, so the other scripts see all of the metadata
+        if os.path.exists(METADATA_JOURNAL):
+            save_video_database(video_db, SCREENSHOT_DATA)
+    screenshot_loop.call_soon_threadsafe(screenshot_loop.stop)
     print("\nScript finished.")
\ No newline at end of file
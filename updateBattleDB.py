@@ -1,7 +1,11 @@
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # --- CONFIGURATION: SET THESE VALUES ---
@@ -17,6 +21,15 @@ LIMIT_PER_PAGE = 1024
 # How many seconds to wait between API calls to avoid rate-limiting
 RATE_LIMIT_DELAY = 1  # 1 second
 
+# Pages requested ahead of the one being processed. Requests still start at
+# most once every RATE_LIMIT_DELAY, but their round trips overlap.
+PREFETCH_PAGES = 4
+
+# Retries of failed API requests. A 429 or 503 response waits as long as
+# its Retry-After header asks; otherwise the wait backs off exponentially.
+API_MAX_RETRIES = 3
+API_RETRY_BACKOFF = 0.5
+
 
 # Stop fetching battles older than this date (YYYY-MM-DDTHH:MM:SS.mmmZ)
 # This is useful for the first sync to avoid fetching all of history.
@@ -38,6 +51,12 @@ def setup_database(db_name):
     # This will create the file if it doesn't exist
     conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
+    # Bulk-ingest settings: WAL with relaxed syncing, temp tables in memory
+    cursor.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+    """)
 
     # --- Create battles table ---
     # Stores one row per battle
@@ -70,6 +89,36 @@ def setup_database(db_name):
     )
     ''')
 
+    # --- Create sync_state table ---
+    # Where an interrupted sync left off, so the next run resumes it
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+
+    # --- Covering index for the map lookups in exportForFrontend.py ---
+    # Lets the battles JOIN read map_name straight from the index.
+    # battle_videos is already covered by the index behind its UNIQUE constraint.
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_b_battle_map ON battles (battle_id, map_name)
+    ''')
+
+    # --- Index for get_last_sync_timestamp ---
+    # MAX(timestamp) becomes a single index lookup instead of a table scan.
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_battles_timestamp ON battles (timestamp)
+    ''')
+
+    # --- Covering index for the per-player lookups ---
+    # The PRIMARY KEY starts with battle_id, so it can't serve lookups by
+    # player_name. The player index in exportForFrontend.py and the roster
+    # load in findScreenshotBattles.py group and sort by player_name.
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_bp_player ON battle_participants (player_name, battle_id)
+    ''')
+
     print(f"Database '{db_name}' initialized and tables ensured.")
     conn.commit()
     return conn
@@ -93,161 +142,254 @@ def get_last_sync_timestamp(conn):
         return None
 
 
-def fetch_battles_from_api(since_timestamp=None):
+def get_resume_state(conn):
     """
-    Fetches battle data from the API.
-    This is a generator, yielding battles one by one to save memory.
-    It handles pagination automatically.
+    Finds where an interrupted sync left off. Pages are committed one by
+    one, newest first, so after an interruption MAX(timestamp) is already
+    past the older battles that were never fetched. Instead, the interrupted
+    sync's own since_timestamp and last committed page are kept in sync_state.
+    New battles only push older ones to later pages, so resuming after that
+    page never skips a battle.
+    Returns (since_timestamp, last_page_completed), or None if the last sync finished.
+    """
+    state = dict(conn.execute("SELECT key, value FROM sync_state"))
+    if 'last_page_completed' not in state:
+        return None
+    since_timestamp = state.get('since_timestamp')
+    last_page = int(state['last_page_completed'])
+    print(f"Resuming an interrupted sync after page {last_page} "
+          f"(back to {since_timestamp or 'the earliest battle'}).")
+    return since_timestamp, last_page
+
+
+def make_api_session():
+    """
+    Creates the HTTP session for the API. All pages are fetched over one
+    kept-alive connection, and failed requests are retried.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=API_MAX_RETRIES,
+        backoff_factor=API_RETRY_BACKOFF,
+        status_forcelist=[429, 502, 503, 504],
+        respect_retry_after_header=True,
+    )
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=PREFETCH_PAGES, max_retries=retry))
+    return session
+
+
+def fetch_battles_from_api(since_timestamp=None, start_page=1):
+    """
+    Fetches battle data from the API, starting at start_page.
+    This is a generator, yielding a (page, battles) pair per page to save
+    memory, so each page can be committed on its own.
+    It handles pagination automatically. A failed request is raised
+    after the pages before it were yielded.
     
     It fetches pages until it finds a battle timestamp that is
-    older than or equal to 'since_timestamp'.
+    older than or equal to 'since_timestamp'. Once a page was entirely
+    newer than that, the next PREFETCH_PAGES pages are requested in the
+    background while a page is processed. When the fetch stops, look-ahead
+    requests that haven't been sent yet are skipped.
     """
     
     # Start with parameters.
     # The API uses 'page' and 'limit'. 'page' starts at 1.
     params = {
-        'page': 1,
+        'page': start_page,
         'limit': LIMIT_PER_PAGE,
         'endedNormally': 'true'
     }
+    request_lock = threading.Lock()
+    next_request_time = [0.0]
+    stop_fetching = threading.Event()
+
+    def fetch_page(session, page):
+        # Be a good citizen and don't spam the API: requests from all
+        # prefetch threads start at least RATE_LIMIT_DELAY apart
+        with request_lock:
+            delay = next_request_time[0] - time.monotonic()
+            # Wakes up early, without sending the request, once the fetch stopped
+            if stop_fetching.wait(max(delay, 0)):
+                return None
+            next_request_time[0] = time.monotonic() + RATE_LIMIT_DELAY
+        page_params = dict(params, page=page)
+        print(f"Requesting: {API_BASE_URL} with params: {page_params}")
+        response = session.get(API_BASE_URL, params=page_params)
+        # Raise an exception for bad status codes (4xx, 5xx)
+        response.raise_for_status() 
+        return response.json()
+
+    # Pages requested but not processed yet, in page order
+    pending_pages = {}
+    next_page = params['page']
+    # An incremental sync usually ends on its first page, so pages are only
+    # requested ahead once a page didn't reach since_timestamp
+    look_ahead = 1 if since_timestamp else PREFETCH_PAGES
     
-    # This is our pagination loop
-    while True:
-        print(f"Requesting: {API_BASE_URL} with params: {params}")
+    # This is our pagination loop, over one session for all pages
+    with make_api_session() as session, ThreadPoolExecutor(max_workers=PREFETCH_PAGES) as executor:
         try:
-            response = requests.get(API_BASE_URL, params=params)
-            # Raise an exception for bad status codes (4xx, 5xx)
-            response.raise_for_status() 
-            data = response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching from API: {e}")
-            break
-        # --- END REAL API CALL ---
-
-        # --- PARSE THE RESPONSE ---
-        # The battle data is an object with numeric keys: {"0": {...}, "1": {...}}
-        battles_dict = data.get('data', {})
+            while True:
+                # Keep the look-ahead window full
+                while len(pending_pages) < look_ahead:
+                    pending_pages[next_page] = executor.submit(fetch_page, session, next_page)
+                    next_page += 1
+                try:
+                    data = pending_pages.pop(params['page']).result()
+                except requests.exceptions.RequestException as e:
+                    print(f"Error fetching from API: {e}")
+                    raise
+                # --- END REAL API CALL ---
+
+                # --- PARSE THE RESPONSE ---
+                # The battle data is an object with numeric keys: {"0": {...}, "1": {...}}
+                battles_dict = data.get('data', {})
         
-        # Stop pagination if the 'data' object is empty
-        if not battles_dict:
-            print("No more battles found on this page. Fetch complete.")
-            break
-
-        # Yield each battle individually
-        # We sort by the keys as strings to process them in order, just in case
-        for battle in battles_dict:
+                # Stop pagination if the 'data' object is empty
+                if not battles_dict:
+                    print("No more battles found on this page. Fetch complete.")
+                    break
+
+                # Collect the new battles of this page, then yield them together
+                page_battles = []
+                for battle in battles_dict:
             
-            try:
-                battle_timestamp = battle['startTime']
+                    try:
+                        battle_timestamp = battle['startTime']
                 
-                # --- SYNC LOGIC 1: NEW BATTLES ---
-                # If we have a 'since_timestamp' (from a previous run) and this battle
-                # is older or the same, we've seen it. Stop the entire fetch process.
-                if since_timestamp and battle_timestamp and battle_timestamp <= since_timestamp:
-                    print(f"Encountered battle {battle['id']} from {battle_timestamp}, "
-                          "which is at or before our last sync. Stopping fetch.")
-                    return  # This stops the generator
+                        # --- SYNC LOGIC 1: NEW BATTLES ---
+                        # If we have a 'since_timestamp' (from a previous run) and this battle
+                        # is older or the same, we've seen it. Stop the entire fetch process.
+                        if since_timestamp and battle_timestamp and battle_timestamp <= since_timestamp:
+                            print(f"Encountered battle {battle['id']} from {battle_timestamp}, "
+                                  "which is at or before our last sync. Stopping fetch.")
+                            yield params['page'], page_battles
+                            return  # This stops the generator
                 
-                # --- SYNC LOGIC 2: HISTORICAL LIMIT ---
-                # If we have a 'EARLIEST_BATTLE_TIMESTAMP' (for first sync) and this
-                # battle is older than that, stop the fetch.
-                if EARLIEST_BATTLE_TIMESTAMP and battle_timestamp and battle_timestamp < EARLIEST_BATTLE_TIMESTAMP:
-                    print(f"Encountered battle {battle['id']} from {battle_timestamp}, "
-                          f"which is before the configured earliest date ({EARLIEST_BATTLE_TIMESTAMP}).")
-                    print("Stopping historical sync.")
-                    return # This stops the generator
+                        # --- SYNC LOGIC 2: HISTORICAL LIMIT ---
+                        # If we have a 'EARLIEST_BATTLE_TIMESTAMP' (for first sync) and this
+                        # battle is older than that, stop the fetch.
+                        if EARLIEST_BATTLE_TIMESTAMP and battle_timestamp and battle_timestamp < EARLIEST_BATTLE_TIMESTAMP:
+                            print(f"Encountered battle {battle['id']} from {battle_timestamp}, "
+                                  f"which is before the configured earliest date ({EARLIEST_BATTLE_TIMESTAMP}).")
+                            print("Stopping historical sync.")
+                            yield params['page'], page_battles
+                            return # This stops the generator
                 
-                # If it's a new battle and within our desired date range, yield it
-                yield battle
+                        # If it's a new battle and within our desired date range, keep it
+                        page_battles.append(battle)
 
-            except KeyError as e:
-                print(f"Skipping battle due to missing key: {e}. Data: {battle}")
-                continue
+                    except KeyError as e:
+                        print(f"Skipping battle due to missing key: {e}. Data: {battle}")
+                        continue
 
+                yield params['page'], page_battles
 
-        # --- PAGINATION ---
-        # Go to the next page
-        params['page'] += 1
-        
-        # Be a good citizen and don't spam the API
-        time.sleep(RATE_LIMIT_DELAY)
+                # --- PAGINATION ---
+                # Go to the next page
+                params['page'] += 1
+                look_ahead = PREFETCH_PAGES
+        finally:
+            # Don't send the look-ahead requests of pages that won't be used
+            stop_fetching.set()
+            executor.shutdown(wait=False, cancel_futures=True)
 
 
-def process_and_insert_data(conn, battle_generator):
+def insert_battle_rows(conn, battle_rows, player_rows, link_rows):
     """
-    Takes battles from the generator and inserts them into the
-    database in a single transaction.
+    Writes the buffered rows with one executemany per table and empties the
+    buffers. INSERT OR IGNORE skips rows whose PRIMARY KEY already exists,
+    so only the new rows change conn.total_changes.
+    Returns the (battles, players, links) counts of new rows.
+    """
+    cursor = conn.cursor()
+    counts = []
+    for sql, rows in (
+        ('INSERT OR IGNORE INTO battles (battle_id, timestamp, map_name) VALUES (?, ?, ?)', battle_rows),
+        ('INSERT OR IGNORE INTO players (player_name) VALUES (?)', player_rows),
+        ('INSERT OR IGNORE INTO battle_participants (battle_id, player_name) VALUES (?, ?)', link_rows),
+    ):
+        changes_before = conn.total_changes
+        cursor.executemany(sql, rows)
+        counts.append(conn.total_changes - changes_before)
+        rows.clear()
+    return tuple(counts)
+
+
+def process_and_insert_data(conn, battle_pages, since_timestamp=None):
+    """
+    Takes the pages of battles from the generator and inserts them into
+    the database, in one transaction per page. Each page's rows are written
+    with executemany, and the page is recorded in sync_state in the same
+    transaction, so an interrupted sync resumes after the last committed page.
     """
     cursor = conn.cursor()
     battles_processed = 0
     players_updated = 0
     links_created = 0
+    battle_rows = []
+    player_rows = []
+    link_rows = []
+    page = None
 
     try:
-        # Start a transaction for much faster inserts
-        cursor.execute("BEGIN TRANSACTION")
+        for page, battles in battle_pages:
+            # Start a transaction for much faster inserts
+            cursor.execute("BEGIN TRANSACTION")
 
-        for battle in battle_generator:
-            
-            # --- Extract data from the battle object ---
-            try:
-                battle_id = battle['id']
-                timestamp = battle['startTime']
-                # Use .get() for safe nested dictionary access
-                map_name = battle.get('Map', {}).get('scriptName')
-                ally_teams = battle.get('AllyTeams', [])
+            for battle in battles:
                 
-                if not ally_teams:
-                    print(f"Skipping battle {battle_id} as it has no AllyTeams data.")
-                    continue
+                # --- Extract data from the battle object ---
+                try:
+                    battle_id = battle['id']
+                    timestamp = battle['startTime']
+                    # Use .get() for safe nested dictionary access
+                    map_name = battle.get('Map', {}).get('scriptName')
+                    ally_teams = battle.get('AllyTeams', [])
                     
-            except KeyError as e:
-                print(f"Skipping battle due to missing key: {e}. Data: {battle}")
-                continue
-            # --- END EXTRACTION ---
-
-            # 1. Insert the battle
-            # INSERT OR IGNORE skips if the PRIMARY KEY (battle_id) already exists
-            cursor.execute('''
-            INSERT OR IGNORE INTO battles (battle_id, timestamp, map_name)
-            VALUES (?, ?, ?)
-            ''', (battle_id, timestamp, map_name))
-            
-            if cursor.rowcount > 0:
-                battles_processed += 1
-
-            # 2. Loop through participants to update players and links
-            for team in ally_teams:
-                for player in team.get('Players', []):
-                    try:
-                        player_name = player['name']
-                        if not player_name:
-                            continue # Skip if name is empty
-                    except KeyError:
-                        # Skip player if 'name' key doesn't exist
+                    if not ally_teams:
+                        print(f"Skipping battle {battle_id} as it has no AllyTeams data.")
                         continue
-
-                    # 2a. Insert the player into the 'players' table
-                    # INSERT OR IGNORE skips if player_name (Primary Key) already exists
-                    cursor.execute('''
-                    INSERT OR IGNORE INTO players (player_name)
-                    VALUES (?)
-                    ''', (player_name,))
-                    
-                    if cursor.rowcount > 0:
-                        players_updated += 1 # Counts new players
-
-                    # 2b. Link the player to the battle in the junction table
-                    # INSERT OR IGNORE skips if the link (battle_id, player_name) already exists
-                    cursor.execute('''
-                    INSERT OR IGNORE INTO battle_participants (battle_id, player_name)
-                    VALUES (?, ?)
-                    ''', (battle_id, player_name))
-
-                    if cursor.rowcount > 0:
-                        links_created += 1
-
-        # Commit the transaction
+                        
+                except KeyError as e:
+                    print(f"Skipping battle due to missing key: {e}. Data: {battle}")
+                    continue
+                # --- END EXTRACTION ---
+
+                # 1. Buffer the battle
+                battle_rows.append((battle_id, timestamp, map_name))
+
+                # 2. Loop through participants to buffer players and links
+                for team in ally_teams:
+                    for player in team.get('Players', []):
+                        try:
+                            player_name = player['name']
+                            if not player_name:
+                                continue # Skip if name is empty
+                        except KeyError:
+                            # Skip player if 'name' key doesn't exist
+                            continue
+
+                        # 2a. The player for the 'players' table
+                        player_rows.append((player_name,))
+                        # 2b. The link of the player to the battle in the junction table
+                        link_rows.append((battle_id, player_name))
+
+            # 3. Write the page's rows
+            new_battles, new_players, new_links = insert_battle_rows(conn, battle_rows, player_rows, link_rows)
+            battles_processed += new_battles
+            players_updated += new_players # Counts new players
+            links_created += new_links
+
+            # 4. Record the page and commit it together with its rows
+            cursor.executemany('''
+            INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)
+            ''', [('since_timestamp', since_timestamp), ('last_page_completed', page)])
+            conn.commit()
+
+        # The sync reached its end, so the next one starts from the newest battle
+        cursor.execute("DELETE FROM sync_state")
         conn.commit()
         print("\n--- Sync Complete ---")
         print(f"New battles added: {battles_processed}")
@@ -256,6 +398,13 @@ def process_and_insert_data(conn, battle_generator):
         if battles_processed == 0:
             print("Database is already up-to-date.")
 
+    except requests.exceptions.RequestException:
+        # Pages are only fetched between transactions, so nothing is left open
+        print("\n--- Sync Interrupted ---")
+        print(f"New battles added before the error: {battles_processed}")
+        if page is not None:
+            print(f"The next run resumes after page {page}.")
+
     except Exception as e:
         print(f"An error occurred during database insertion: {e}")
         print("Rolling back transaction...")
@@ -269,16 +418,24 @@ def main():
     # 1. Connect to DB and create tables if they don't exist
     conn = setup_database(DB_NAME)
     
-    # 2. Find out where we left off
-    last_sync = get_last_sync_timestamp(conn)
+    # 2. Find out where we left off: an interrupted sync is resumed,
+    # otherwise only battles newer than the newest one we have are fetched
+    resume_state = get_resume_state(conn)
+    if resume_state:
+        last_sync, last_page = resume_state
+    else:
+        last_sync, last_page = get_last_sync_timestamp(conn), 0
+    
+    # 3. Get a generator for the pages of new battles from the API
+    battle_pages = fetch_battles_from_api(last_sync, start_page=last_page + 1)
     
-    # 3. Get a generator for new battles from the API
-    battle_generator = fetch_battles_from_api(last_sync)
+    # 4. Process all pages from the generator and insert into DB
+    process_and_insert_data(conn, battle_pages, last_sync)
     
-    # 4. Process all battles from the generator and insert into DB
-    process_and_insert_data(conn, battle_generator)
+    # 5. Refresh planner statistics so the export queries pick the indexes
+    conn.execute("ANALYZE")
     
-    # 5. Close the database connection
+    # 6. Close the database connection
     conn.close()
     print("--- Database Update Script Finished ---")
 